@@ -1,4 +1,4 @@
-import asyncio, os
+import asyncio, os, time
 
 import discord
 from discord.ext import commands
@@ -6,6 +6,8 @@ from discord import FFmpegOpusAudio
 
 #from sinks.stream_sink import StreamSink #Outputs audio to desired output audio device (tested on windows)
 from sinks.whisper_sink import WhisperSink #User whisper to transcribe audio and outputs to TTS
+from sinks.events import FINISH
+from sinks.latency import LatencyTracker
 
 #You should replace these with your llm and tts of choice
 from modules import llm_dialo, tts_windows
@@ -31,6 +33,9 @@ speech = tts_windows.TTS()
   
 voice_channel = None
 
+#Per stage latency of every utterance, from its first packet to the bot's answer
+latency_tracker = LatencyTracker()
+
 #In a seperate async thread, recieves messages from STT
 async def whisper_message(queue : asyncio.Queue):
  while True:
@@ -38,16 +43,22 @@ async def whisper_message(queue : asyncio.Queue):
 
     if response is None:
         break
-    else:
-        user_id = response["user"]
-        text = response["result"]
+    #Only answer once the user has finished talking
+    elif response.type == FINISH:
+        timestamps = response.timestamps
+        timestamps["pickup"] = time.time()
+
+        user_id = response.user
+        text = response.result
                 
         username = await get_username(user_id)  
 
         print(f"Detected Message: {text}")
 
         answer = await loop.run_in_executor(None, ai.chat, username, text)
-        await play_audio(answer)
+        timestamps["llm_done"] = time.time()
+        await play_audio(answer, timestamps)
+        latency_tracker.record(timestamps)
 
 @client.command()
 async def quit(ctx):
@@ -68,6 +79,7 @@ async def join(ctx):
         queue = asyncio.Queue()
         loop.create_task(whisper_message(queue))
         whisper_sink = WhisperSink(queue, 
+                                   loop,
                                    data_length=50000, 
                                    quiet_phrase_timeout=1.25, 
                                    mid_sentence_multiplier=1.75, 
@@ -104,6 +116,8 @@ async def on_ready():
                 f'{guild.name}(id: {guild.id})'
             )
     print(f"We have logged in as {client.user}")
+    # Load and warm up the STT model in the background so the first !join and first transcription are fast
+    loop.run_in_executor(None, WhisperSink.default_backend().warmup)
 
 @client.event
 async def on_message(message : discord.Message):  
@@ -150,21 +164,31 @@ async def on_message(message : discord.Message):
 
 #Plays an audio file through discord. So far only audio files work, not streaming.
 #TODO make voice_channel.play async. Probably need to use the callback feature.
-async def play_audio(text):
+#timestamps gets when the TTS was done and when playback started, for latency tracking
+async def play_audio(text, timestamps=None):
     global voice_channel   
+    if timestamps is None:
+        timestamps = {}
     if voice_channel is not None:      
         audio_file = await loop.run_in_executor(None, speech.tts_wav, text)
+        timestamps["tts_done"] = time.time()
         if audio_file is not None:
             while voice_channel.is_playing():
                 await asyncio.sleep(.1)
             prepared_audio = FFmpegOpusAudio(audio_file, executable="ffmpeg")
             voice_channel.play(prepared_audio)
+            timestamps["playback"] = time.time()
 
 #Stops the bot if they are speaking
 @client.command()
 async def stop(ctx):
     ctx.guild.voice_client.stop()
 
+#Sends the per stage latency of the utterances answered so far
+@client.command()
+async def latency(ctx):
+    await ctx.send(f"```\n{latency_tracker.report()}\n```")
+
 async def get_username(user_id):
     return await client.fetch_user(user_id)
 
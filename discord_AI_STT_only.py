@@ -1,8 +1,9 @@
-import asyncio, os
+import asyncio, os, time
 
 from dotenv import load_dotenv
 
 from sinks.iwhisper_sink import iWhisperSink
+from sinks.latency import LatencyTracker
 load_dotenv()
 
 import discord
@@ -30,6 +31,9 @@ client = commands.Bot(command_prefix="!", intents=intents, loop=loop)
  
 voice_channel = None
 
+#Per stage latency of every utterance, from its first packet to the bot's answer
+latency_tracker = LatencyTracker()
+
 #In a seperate async thread, recieves messages from STT
 async def whisper_message(queue : asyncio.Queue):
  while True:
@@ -38,8 +42,12 @@ async def whisper_message(queue : asyncio.Queue):
     if response is None:
         break
     else:
-        user_id = response["user"]
-        text = response["result"]
+        if response.timestamps is not None:
+            response.timestamps["pickup"] = time.time()
+            latency_tracker.record(response.timestamps)
+
+        user_id = response.user
+        text = response.result
                 
         username = await get_username(user_id)  
 
@@ -102,6 +110,8 @@ async def on_ready():
                 f'{guild.name}(id: {guild.id})'
             )
     print(f"We have logged in as {client.user}")
+    # Load and warm up the STT model in the background so the first !join and first transcription are fast
+    loop.run_in_executor(None, iWhisperSink.default_backend().warmup)
 
 @client.event
 async def on_message(message : discord.Message):  
@@ -133,6 +143,11 @@ async def on_message(message : discord.Message):
 async def stop(ctx):    
     ctx.guild.voice_client.stop()
 
+#Sends the per stage latency of the utterances answered so far
+@client.command()
+async def latency(ctx):
+    await ctx.send(f"```\n{latency_tracker.report()}\n```")
+
 async def get_username(user_id):
     return await client.fetch_user(user_id)
 
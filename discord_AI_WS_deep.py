@@ -3,6 +3,7 @@ import asyncio, os, json, time
 from dotenv import load_dotenv
 
 from sinks.whisper_sink import WhisperSink
+from sinks.latency import LatencyTracker
 
 load_dotenv()
 
@@ -39,6 +40,8 @@ client = commands.Bot(command_prefix="!", intents=intents, loop=loop)
 
 voice_channel = None
 
+# Per stage latency of every utterance, from its first packet to the bot's answer
+latency_tracker = LatencyTracker()
 
 # In a seperate async thread, recieves messages from STT
 async def whisper_message(queue: asyncio.Queue):
@@ -48,13 +51,16 @@ async def whisper_message(queue: asyncio.Queue):
         if response is None:
             break
         else:
-            user_id = response["user"]
-            text = response["result"]
-            type = response["type"]
-            username = await get_username(user_id)
+            if response.timestamps is not None:
+                response.timestamps["pickup"] = time.time()
+                latency_tracker.record(response.timestamps)
 
-            print(f"{time.time()} {username} Detected Message: {text}")
-            obj = {"type": type , "name": username.display_name, "text": text}
+            username = await get_username(response.user)
+
+            print(f"{time.time()} {username} Detected Message: {response.result}")
+            # Progress only carries the end of the text that changed, see sinks.events
+            obj = response.to_dict()
+            obj["name"] = username.display_name
             safeWSsend(json.dumps(obj))
 
 
@@ -147,6 +153,13 @@ async def on_message(message: discord.Message):
 async def stop(ctx):
     ctx.guild.voice_client.stop()
 
+
+# Sends the per stage latency of the utterances answered so far
+@client.command()
+async def latency(ctx):
+    await ctx.send(f"```\n{latency_tracker.report()}\n```")
+
+
 async def get_username(user_id):
     # cache and optimize
     if user_id in cacheNames:
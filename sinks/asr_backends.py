@@ -0,0 +1,287 @@
+# Default libraries
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party libraries
+import numpy as np
+
+from sinks.audio import WHISPER_SAMPLE_RATE
+from sinks.clock import SystemClock
+from sinks.streaming import Segment, Word
+
+
+class ASRBackend:
+    """Speech to text model used by the whisper sinks.\n
+
+    transcribe_batch takes a list of 16 kHz mono float32 clips and a prompt for each clip (the text already committed for that speaker).\n
+    It returns a list of Segments for every clip, in the same order.\n
+    keys says which speaker each clip belongs to, backends that spread work over several workers use it to keep a speaker on the same worker.\n
+    Backends that can't use prompts are free to ignore them.\n
+
+    Creating a backend is cheap, the model is only loaded by load_model() the first time it is needed.\n
+    Subclasses implement load_model() and decode_batch().\n
+    """
+
+    sample_rate = WHISPER_SAMPLE_RATE
+
+    def __init__(self):
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self.warm = False
+
+    # Loads the model the first time it is needed, safe to call from several threads
+    def load(self):
+        with self.load_lock:
+            if not self.loaded:
+                self.load_model()
+                self.loaded = True
+
+    def load_model(self):
+        pass
+
+    # Loads the model and decodes a second of silence, so the first real utterance isn't the slowest one
+    def warmup(self):
+        self.load()
+        if not self.warm:
+            self.decode_batch([np.zeros(self.sample_rate, dtype=np.float32)], [""])
+            self.warm = True
+
+    def transcribe_batch(self, audios, prompts, keys=None):
+        self.load()
+        return self.decode_batch(audios, prompts)
+
+    # Called when the sink is done with a speaker
+    def release(self, key):
+        pass
+
+    def decode_batch(self, audios, prompts):
+        raise NotImplementedError
+
+
+class FasterWhisperBackend(ASRBackend):
+    """faster whisper (CTranslate2). Defaults to int8 on the CPU, pass device="cuda", compute_type="float16" for a GPU.\n
+
+    faster whisper can't put different clips into one call, but CTranslate2 releases the GIL.\n
+    Every clip in a batch is submitted at once and decoded in parallel on the model's workers.\n
+    Each worker is another copy of the model, on a GPU that is the model's VRAM again for every worker (about 1.5 GB for distil-large-v3 in float16).\n
+    With the default of 1 the clips of a batch are decoded one after another.\n
+    cpu_threads is the number of threads each decode uses on the CPU, 0 lets CTranslate2 decide.\n
+    """
+
+    def __init__(
+        self,
+        model="distil-large-v3",
+        *,
+        device="cpu",
+        compute_type="int8",
+        workers=1,
+        cpu_threads=0,
+        **transcribe_options
+    ):
+        super().__init__()
+        self.model_name = model
+        self.device = device
+        self.compute_type = compute_type
+        self.workers = workers
+        self.cpu_threads = cpu_threads
+
+        self.model = None
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        self.transcribe_options = dict(
+            beam_size=10,
+            best_of=3,
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=250),
+            no_speech_threshold=0.6,
+        )
+        self.transcribe_options.update(transcribe_options)
+
+    def load_model(self):
+        import torch  # Had issues where removing torch causes whisper to throw an error
+        from faster_whisper import WhisperModel
+
+        # num_workers lets CTranslate2 decode that many clips in parallel when called from multiple threads
+        self.model = WhisperModel(
+            self.model_name,
+            device=self.device,
+            compute_type=self.compute_type,
+            num_workers=self.workers,
+            cpu_threads=self.cpu_threads,
+        )
+
+    # The VAD filter would remove the silent warm up clip entirely and whisper would never run, so it's off for the warm up
+    def warmup(self):
+        self.load()
+        if not self.warm:
+            self.transcribe_clip(
+                np.zeros(self.sample_rate, dtype=np.float32), "", vad_filter=False
+            )
+            self.warm = True
+
+    def decode_batch(self, audios, prompts):
+        return list(self.pool.map(self.transcribe_clip, audios, prompts))
+
+    # options override the backend's transcribe options for this clip
+    def transcribe_clip(self, audio, prompt, **options):
+        segments, info = self.model.transcribe(
+            audio,
+            initial_prompt=prompt or None,
+            word_timestamps=True,
+            **{**self.transcribe_options, **options}
+        )
+        return [
+            Segment(
+                segment.text,
+                segment.start,
+                segment.end,
+                [Word(word.word, word.start, word.end) for word in segment.words],
+                segment.avg_logprob,
+                segment.no_speech_prob,
+                segment.compression_ratio,
+            )
+            for segment in segments
+        ]
+
+
+class TransformersBackend(ASRBackend):
+    """Hugging Face transformers ASR pipeline (insanely fast whisper).\n
+
+    Every clip goes into the same batched pipeline call.\n
+    The pipeline shares generate_kwargs across the batch, so per clip prompts are not used.\n
+    """
+
+    def __init__(
+        self,
+        model="openai/whisper-large-v3",
+        *,
+        device="cuda:0",
+        torch_dtype="float16",
+        batch_size=24,
+    ):
+        super().__init__()
+        self.model_name = model
+        self.device = device
+        self.torch_dtype = torch_dtype
+        self.batch_size = batch_size
+
+        self.pipe = None
+
+    def load_model(self):
+        import torch  # Had issues where removing torch causes whisper to throw an error
+        from transformers import pipeline
+        from transformers.utils import is_flash_attn_2_available
+
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=self.model_name,  # select checkpoint from https://huggingface.co/openai/whisper-large-v3#model-details
+            torch_dtype=getattr(torch, self.torch_dtype),
+            device=self.device,  # or mps for Mac devices
+            model_kwargs=(
+                {"attn_implementation": "flash_attention_2"}
+                if is_flash_attn_2_available()
+                else {"attn_implementation": "sdpa"}
+            ),
+        )
+
+    def decode_batch(self, audios, prompts):
+        outputs = self.pipe(
+            [{"raw": audio, "sampling_rate": self.sample_rate} for audio in audios],
+            chunk_length_s=30,
+            batch_size=self.batch_size,
+            generate_kwargs={"language": "en"},
+            return_timestamps="word",
+        )
+
+        results = []
+        for output in outputs:
+            words = [
+                Word(chunk["text"], chunk["timestamp"][0], chunk["timestamp"][1])
+                for chunk in output["chunks"]
+            ]
+            if words:
+                results.append(
+                    [Segment(output["text"], words[0].start, words[-1].end, words)]
+                )
+            else:
+                results.append([])
+        return results
+
+
+class FakeBackend(ASRBackend):
+    """Deterministic backend for testing and benchmarking the sinks without a model or a GPU.\n
+
+    script - Transcripts handed out in order, one per clip. Each entry is a string or a list of Segments.\n
+    The last entry is repeated once the script runs out, an empty script always returns no speech.\n
+    Words of a string are spread evenly over the clip.\n
+    delay - Seconds every transcribe_batch call takes\n
+    realtime_factor - Extra seconds per second of audio in the batch, to simulate a slower model\n
+    clock - Where the time is spent, give it the sink's sinks.clock.VirtualClock so decodes take virtual time too\n
+    """
+
+    def __init__(self, script=None, *, delay=0.0, realtime_factor=0.0, clock=None):
+        super().__init__()
+        self.script = list(script or [])
+        self.delay = delay
+        self.realtime_factor = realtime_factor
+        self.clock = clock if clock is not None else SystemClock()
+
+        self.calls = 0
+        self.position = 0
+        self.last_prompts = []
+
+    def next_entry(self):
+        if not self.script:
+            return ""
+        entry = self.script[min(self.position, len(self.script) - 1)]
+        self.position += 1
+        return entry
+
+    def scripted_segments(self, entry, duration):
+        if not isinstance(entry, str):
+            return entry
+
+        texts = entry.split()
+        if not texts:
+            return []
+        step = duration / len(texts)
+        words = [
+            Word(" " + text, index * step, (index + 1) * step)
+            for index, text in enumerate(texts)
+        ]
+        return [Segment(" " + entry.strip(), 0, duration, words)]
+
+    # There is nothing to load, and a warm up decode would use up an entry of the script
+    def warmup(self):
+        pass
+
+    def decode_batch(self, audios, prompts):
+        self.calls += 1
+        self.last_prompts = list(prompts)
+
+        seconds = sum(len(audio) for audio in audios) / self.sample_rate
+        wait = self.delay + seconds * self.realtime_factor
+        if wait > 0:
+            self.clock.sleep(wait)
+
+        return [
+            self.scripted_segments(self.next_entry(), len(audio) / self.sample_rate)
+            for audio in audios
+        ]
+
+
+# Backends shared by every sink in the process, so each model is loaded at most once
+shared_backends = {}
+shared_backends_lock = threading.Lock()
+
+
+def shared_backend(backend_class, *args, **kwargs):
+    """Returns the backend created with these arguments, creating it the first time.\n
+
+    Nothing is loaded until the backend is first used or warmed up.\n
+    """
+    key = (backend_class, repr(args), repr(sorted(kwargs.items())))
+    with shared_backends_lock:
+        if key not in shared_backends:
+            shared_backends[key] = backend_class(*args, **kwargs)
+        return shared_backends[key]
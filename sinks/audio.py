@@ -0,0 +1,198 @@
+# Default libraries
+import functools
+
+# 3rd party libraries
+import numpy as np
+
+# Whisper models (faster whisper and transformers) expect 16 kHz mono float32 audio
+WHISPER_SAMPLE_RATE = 16000
+
+# Length of the low-pass filter used before decimating, about 2 ms at 48 kHz
+lowpass_taps = 95
+
+
+# Blackman windowed sinc low-pass for decimating by factor.
+# Cut off a little under the new Nyquist frequency, so 48 kHz to 16 kHz passes speech up to about 6 kHz and stops everything above about 9 kHz.
+@functools.lru_cache(maxsize=None)
+def lowpass_kernel(factor, taps=lowpass_taps):
+    cutoff = 0.45 / factor
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(audio, sampling_rate, target_rate=WHISPER_SAMPLE_RATE):
+    """Resamples a mono float32 array to target_rate.\n
+
+    Discord sends 48 kHz, which is an exact multiple of 16 kHz, so the common case is a low-pass filter and decimation.\n
+    The filter keeps sibilants above the new Nyquist frequency from folding back into the speech band.\n
+    Each call is filtered on its own, use Resampler for a stream of packets.\n
+    Any other rate falls back to linear interpolation.\n
+    """
+    if sampling_rate == target_rate or len(audio) == 0:
+        return audio
+
+    if sampling_rate % target_rate == 0:
+        factor = sampling_rate // target_rate
+        filtered = np.convolve(audio, lowpass_kernel(factor), mode="same")
+        return filtered[::factor].astype(np.float32)
+
+    duration = len(audio) / sampling_rate
+    target_length = int(duration * target_rate)
+    source_times = np.arange(len(audio), dtype=np.float32) / sampling_rate
+    target_times = np.arange(target_length, dtype=np.float32) / target_rate
+    return np.interp(target_times, source_times, audio).astype(np.float32)
+
+
+def pcm_to_float32(raw_bytes, sampling_rate, channels, target_rate=WHISPER_SAMPLE_RATE):
+    """Converts interleaved int16 PCM from discord into a mono float32 array in [-1, 1] at target_rate.\n
+
+    The sinks run this once per packet as it arrives, so buffers hold a sixth of the data and whisper never resamples.\n
+    The result can be handed straight to whisper, no wav file needed.\n
+    """
+    samples = np.frombuffer(raw_bytes, dtype=np.int16)
+    frames = len(samples) // channels
+    audio = samples[: frames * channels].reshape(frames, channels)
+    audio = audio.mean(axis=1, dtype=np.float32) / 32768.0
+    return resample(audio, sampling_rate, target_rate)
+
+
+class Resampler:
+    """pcm_to_float32() for one stream of packets, like one speaker's audio.\n
+
+    The low-pass filter runs over the packets as if they were one signal. The last few samples of each packet are kept for the next one,
+    so there are no clicks at packet edges and the decimation doesn't lose its place when a packet isn't a multiple of the factor.\n
+    """
+
+    def __init__(self, sampling_rate, channels, target_rate=WHISPER_SAMPLE_RATE):
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.target_rate = target_rate
+
+        self.factor = sampling_rate // target_rate if sampling_rate % target_rate == 0 else 0
+        if self.factor > 1:
+            self.kernel = lowpass_kernel(self.factor)
+            # Half a filter of silence in front, so output samples line up with the input instead of lagging behind
+            self.pending = np.zeros(len(self.kernel) // 2, dtype=np.float32)
+
+    def process(self, raw_bytes):
+        if self.factor <= 1:
+            return pcm_to_float32(raw_bytes, self.sampling_rate, self.channels, self.target_rate)
+
+        audio = pcm_to_float32(raw_bytes, self.sampling_rate, self.channels, self.sampling_rate)
+        audio = np.concatenate((self.pending, audio))
+        taps = len(self.kernel)
+        if len(audio) < taps:
+            self.pending = audio
+            return np.zeros(0, dtype=np.float32)
+
+        outputs = (len(audio) - taps) // self.factor + 1
+        used = outputs * self.factor
+        filtered = np.convolve(audio[: used + taps - self.factor], self.kernel, mode="valid")
+        self.pending = audio[used:]
+        return filtered[:: self.factor].astype(np.float32)
+
+
+# Root mean square energy of a float32 clip, 0 for silence and around 0.05 - 0.2 for speech
+def rms(audio):
+    if len(audio) == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(np.square(audio))))
+
+
+# rms() of raw int16 PCM from discord, for sinks that pass the packets on unconverted
+def pcm_rms(raw_bytes):
+    samples = np.frombuffer(raw_bytes, dtype=np.int16)
+    return rms(samples.astype(np.float32) / 32768.0)
+
+
+def trim_silence(audio, threshold, padding, frame_size=WHISPER_SAMPLE_RATE // 50):
+    """Finds the part of a clip that isn't silent, checked in 20 ms frames.\n
+
+    Returns (start, end) sample offsets, keeping padding samples of silence on each side so word edges aren't cut.\n
+    (0, 0) means the whole clip is silent.\n
+    """
+    frames = len(audio) // frame_size
+    if frames == 0:
+        return (0, len(audio)) if rms(audio) >= threshold else (0, 0)
+
+    energy = np.sqrt(
+        np.mean(np.square(audio[: frames * frame_size].reshape(frames, frame_size)), axis=1)
+    )
+    loud = np.flatnonzero(energy >= threshold)
+    if len(loud) == 0:
+        return 0, 0
+
+    start = max(int(loud[0]) * frame_size - padding, 0)
+    end = min((int(loud[-1]) + 1) * frame_size + padding, len(audio))
+    # The few samples after the last full frame can't be judged yet, keep them
+    if loud[-1] == frames - 1:
+        end = len(audio)
+    return start, end
+
+
+class PCMBuffer:
+    """Preallocated float32 buffer holding one speaker's 16 kHz mono audio.\n
+
+    Packets are copied into free space in place instead of being kept as a list of bytes.\n
+    view() is a zero-copy numpy view of the audio still waiting to be transcribed, and is what whisper gets.\n
+    consume() only moves the read pointer.\n
+    When the write pointer reaches the end, the unread audio is moved back to the front, or the buffer doubles if it is full.\n
+    compact() gives memory back after a long utterance made it grow.\n
+    """
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    # Bytes allocated, not just the audio in it
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+    def view(self):
+        return self.buffer[self.start : self.end]
+
+    def append(self, audio):
+        samples = len(audio)
+        self.reserve(samples)
+        self.buffer[self.end : self.end + samples] = audio
+        self.end += samples
+        return samples
+
+    def reserve(self, samples):
+        if self.end + samples <= len(self.buffer):
+            return
+
+        size = len(self)
+        if size + samples > len(self.buffer):
+            buffer = np.zeros(max(len(self.buffer) * 2, size + samples), dtype=np.float32)
+            buffer[:size] = self.view()
+            self.buffer = buffer
+        else:
+            self.buffer[:size] = self.view()
+        self.start = 0
+        self.end = size
+
+    # Drop audio from the front, used after whisper has finished with it
+    def consume(self, samples):
+        self.start = min(self.start + samples, self.end)
+        if self.start == self.end:
+            self.clear()
+
+    # Shrinks the buffer back to capacity samples, or to the unread audio if that is longer
+    def compact(self, capacity):
+        size = len(self)
+        buffer = np.zeros(max(capacity, size), dtype=np.float32)
+        buffer[:size] = self.view()
+        self.buffer = buffer
+        self.start = 0
+        self.end = size
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
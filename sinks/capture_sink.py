@@ -0,0 +1,112 @@
+# Default libraries
+import mmap
+import struct
+import threading
+import time
+
+# 3rd party libraries
+from discord.sinks.core import Filters, Sink, default_filters
+
+# File header: magic, format version, sampling rate, channels
+CAPTURE_MAGIC = b"DCAP"
+CAPTURE_VERSION = 1
+header_format = struct.Struct("<4sHIH")
+
+# Every packet: user id, time.time() it arrived in write(), number of PCM bytes that follow
+record_format = struct.Struct("<QdI")
+
+
+class CaptureSink(Sink):
+    """A sink that records every packet discord sends, so a voice session can be replayed later without discord.\n
+
+    The file is a small header followed by (user, timestamp, pcm) records back to back, read it with CaptureReader.\n
+    Pass another sink as sink to record while it keeps working as usual, packets are written to the file and then handed to it.\n
+
+    Inputs:\n
+    path - File the capture is written to, overwritten if it exists\n
+    sink - Sink that also gets every packet, optional\n
+    sampling_rate, channels - Format of discord's PCM, only used for the header\n
+    """
+
+    def __init__(
+        self, path, *, sink=None, filters=None, sampling_rate=48000, channels=2
+    ):
+        if filters is None:
+            filters = default_filters
+        self.filters = filters
+        Filters.__init__(self, **self.filters)
+
+        self.vc = None
+        self.audio_data = {}
+
+        self.sink = sink
+
+        self.file_lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(
+            header_format.pack(CAPTURE_MAGIC, CAPTURE_VERSION, sampling_rate, channels)
+        )
+
+    # Called by discord when recording starts, the wrapped sink needs the voice client too
+    def init(self, vc):
+        super().init(vc)
+        if self.sink is not None:
+            self.sink.init(vc)
+
+    @Filters.container
+    def write(self, data, user):
+        with self.file_lock:
+            if not self.file.closed:
+                self.file.write(record_format.pack(user, time.time(), len(data)))
+                self.file.write(data)
+
+        if self.sink is not None:
+            self.sink.write(data, user)
+
+    def close(self):
+        with self.file_lock:
+            self.file.close()
+
+        if self.sink is not None:
+            self.sink.close()
+
+
+class CaptureReader:
+    """Reads a file written by CaptureSink.\n
+
+    The file is memory mapped, iterating gives (user, timestamp, pcm) with pcm as a memoryview into the map, nothing is copied.\n
+    Use it as a context manager, or call close() once done with the packets.\n
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.sampling_rate, self.channels = header_format.unpack_from(
+            self.map, 0
+        )
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {CAPTURE_VERSION} capture file")
+
+    def __iter__(self):
+        view = memoryview(self.map)
+        offset = header_format.size
+        # A capture cut off mid record (the bot was killed) ends at the last whole record
+        while offset + record_format.size <= len(self.map):
+            user, timestamp, length = record_format.unpack_from(self.map, offset)
+            offset += record_format.size
+            if offset + length > len(self.map):
+                break
+            yield user, timestamp, view[offset : offset + length]
+            offset += length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
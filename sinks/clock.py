@@ -0,0 +1,114 @@
+# Default libraries
+import asyncio
+import threading
+import time
+
+
+class SystemClock:
+    """The real clock, used by the sinks unless they are given another one.\n
+
+    wait() is for the voice thread's threading.Condition and wait_event() for an asyncio.Event.\n
+    Both return once woken up or after timeout seconds.\n
+    sleep() is for work that takes time, like sinks.asr_backends.FakeBackend pretending to decode.\n
+    """
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    # The caller must hold condition, like with condition.wait()
+    def wait(self, condition, timeout=None):
+        return condition.wait(timeout)
+
+    async def wait_event(self, event, timeout=None):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class VirtualClock:
+    """A clock that only moves when advance() is called, so the sinks' timeouts can be simulated faster than real time.\n
+
+    Waits don't time out on their own. advance() wakes every waiter so it can check its deadlines against the new time.\n
+    After advance(), wait_idle() blocks until every thread that waits on this clock is waiting again, so the sink has caught up with the new time before the next step.\n
+    Real time still passes while a model decodes, but none of it shows up on this clock.\n
+    sleep() moves the clock forward instead of waiting, so a FakeBackend given this clock decodes in virtual time and a saturated backend can be simulated.\n
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+        self.lock = threading.Condition()
+        # Goes up on every advance(), waiters note which one they started waiting in
+        self.generation = 0
+        self.waiters = {}
+        self.threads = set()
+        self.async_waiters = set()
+
+    def time(self):
+        return self.now
+
+    def wait(self, condition, timeout=None):
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads.add(thread)
+            self.waiters[thread] = (condition, self.generation)
+            self.lock.notify_all()
+        try:
+            # timeout is in virtual seconds, so only advance() or a notify ends the wait
+            return condition.wait()
+        finally:
+            with self.lock:
+                self.waiters.pop(thread, None)
+
+    async def wait_event(self, event, timeout=None):
+        if timeout is not None and timeout <= 0:
+            return event.is_set()
+
+        waiter = (asyncio.get_running_loop(), event)
+        with self.lock:
+            self.async_waiters.add(waiter)
+        try:
+            await event.wait()
+            return True
+        finally:
+            with self.lock:
+                self.async_waiters.discard(waiter)
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+            self.generation += 1
+            conditions = [condition for condition, generation in self.waiters.values()]
+            async_waiters = list(self.async_waiters)
+
+        # Waiters hold their condition until they are inside wait(), so none of these wake ups can be missed
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
+        for loop, event in async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    # Time spent working, by whoever calls it, shows up on the clock at once
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    # Wakes the waiters even if when has already passed, so wait_idle() also waits for them to handle anything new
+    def advance_to(self, when):
+        self.advance(max(when - self.now, 0))
+
+    # Returns False if the threads were still busy after timeout real seconds
+    def wait_idle(self, timeout=5.0):
+        def idle():
+            self.threads = {thread for thread in self.threads if thread.is_alive()}
+            return all(
+                thread in self.waiters and self.waiters[thread][1] == self.generation
+                for thread in self.threads
+            )
+
+        with self.lock:
+            return self.lock.wait_for(idle, timeout)
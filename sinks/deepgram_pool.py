@@ -0,0 +1,217 @@
+#Default libraries
+import asyncio
+
+#3rd party libraries
+from deepgram import (
+    DeepgramClient,
+    DeepgramClientOptions,
+    LiveTranscriptionEvents,
+)
+
+from sinks.clock import SystemClock
+from sinks.upstream import PCMUpstream
+
+#Method of the owning speaker that gets each Deepgram event
+owner_handlers = {
+    LiveTranscriptionEvents.Open: "on_open",
+    LiveTranscriptionEvents.Transcript: "on_message",
+    LiveTranscriptionEvents.Metadata: "on_metadata",
+    LiveTranscriptionEvents.SpeechStarted: "on_speech_started",
+    LiveTranscriptionEvents.UtteranceEnd: "on_utterance_end",
+    LiveTranscriptionEvents.Close: "on_close",
+    LiveTranscriptionEvents.Error: "on_error",
+    LiveTranscriptionEvents.Unhandled: "on_unhandled",
+}
+
+class PooledConnection():
+    """One open Deepgram live connection.\n
+
+    Its handlers are registered once when it opens and pass every event on to owner, the speaker that checked it out.\n
+    Events that come in while it waits in the pool have no owner and are dropped.\n
+    """
+
+    def __init__(self, pool, connection, upstream, current_time):
+        self.pool = pool
+        self.connection = connection
+        #Encodes the audio for this connection, it has to be one stream even when the connection changes owners
+        self.upstream = upstream
+        self.owner = None
+        self.closed = False
+        self.idle_since = current_time
+
+        for event, name in owner_handlers.items():
+            connection.on(event, self.handler(name))
+
+    def handler(self, name):
+        async def dispatch(client, *args, **kwargs):
+            if name == "on_close":
+                self.closed = True
+                await self.pool.discard(self)
+            owner = self.owner
+            if owner is not None:
+                await getattr(owner, name)(client, *args, **kwargs)
+        return dispatch
+
+class DeepgramPool():
+    """Keeps Deepgram live connections open ahead of time, so a new speaker doesn't wait for a TLS and websocket handshake.\n
+
+    acquire() hands out an idle connection, or opens one if there are none, and release() gives it back.\n
+    The SDK's keepalive stops Deepgram from closing the idle ones.\n
+
+    Inputs:\n
+    api_key - Deepgram API key\n
+    options, addons - What every connection is started with, so they must be the same for every speaker\n
+    upstream - Makes the encoder of each connection, see sinks.upstream. Must match the encoding in options\n
+    url - Deepgram host, point it at a local mock server (http://localhost:8765) for testing. Empty for api.deepgram.com\n
+    warm - Idle connections kept open for the next speakers\n
+    max_size - Most connections open at once, idle or not. acquire() waits for one to be released past that. -1 for no limit\n
+    idle_timeout - Seconds an idle connection past the warm ones stays open\n
+    client - What connections are opened with, anything with listen.asyncwebsocket.v("1") like DeepgramClient. Tests pass a fake one. By default a DeepgramClient for api_key and url\n
+    """
+
+    def __init__(self, api_key, options, addons=None, *, upstream=PCMUpstream, url="", warm=1, max_size=16, idle_timeout=60, loop : asyncio.AbstractEventLoop = None, clock=None, client=None):
+        self.options = options
+        self.addons = addons
+        self.upstream = upstream
+        self.warm = warm
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.clock = clock if clock is not None else SystemClock()
+
+        if client is None:
+            config: DeepgramClientOptions = DeepgramClientOptions(
+                url=url,
+                options={"keepalive": "true"},
+            )
+            client = DeepgramClient(api_key, config)
+        self.client: DeepgramClient = client
+
+        #Every open connection, idle or checked out
+        self.connections = set()
+        #Idle connections, the most recently used last
+        self.idle = []
+        #Connections being opened, they count towards max_size
+        self.opening = 0
+        self.available = asyncio.Condition()
+
+        self.running = True
+
+    #Opens the warm connections and starts tearing down idle ones, call from the event loop
+    def start(self):
+        self.refill()
+        self.loop.create_task(self.maintain())
+
+    def size(self):
+        return len(self.connections) + self.opening
+
+    def full(self):
+        return self.max_size >= 0 and self.size() >= self.max_size
+
+    #Opens a connection, None if Deepgram couldn't be reached. The caller has already counted it in opening
+    async def open(self):
+        try:
+            connection = self.client.listen.asyncwebsocket.v("1")
+            pooled = PooledConnection(self, connection, self.upstream(), self.clock.time())
+            if await connection.start(self.options, addons=self.addons) is False:
+                print("Failed to connect to Deepgram")
+                return None
+            self.connections.add(pooled)
+            return pooled
+        except Exception as e:
+            print(f"Could not open socket: {e}")
+            return None
+        finally:
+            self.opening -= 1
+            await self.notify()
+
+    async def open_idle(self):
+        pooled = await self.open()
+        if pooled is not None:
+            await self.release(pooled)
+
+    #Opens connections in the background until warm of them are idle
+    def refill(self):
+        while self.running and len(self.idle) + self.opening < self.warm and not self.full():
+            self.opening += 1
+            self.loop.create_task(self.open_idle())
+
+    async def notify(self):
+        async with self.available:
+            self.available.notify_all()
+
+    async def acquire(self, owner):
+        """Checks out a connection for owner, whose on_* methods get its events from now on.\n
+
+        Waits while max_size connections are open and none are idle. Returns None if Deepgram couldn't be reached.\n
+        """
+        async with self.available:
+            while True:
+                if not self.running:
+                    return None
+                if self.idle:
+                    pooled = self.idle.pop()
+                    pooled.owner = owner
+                    self.refill()
+                    return pooled
+                if not self.full():
+                    self.opening += 1
+                    break
+                await self.available.wait()
+
+        pooled = await self.open()
+        if pooled is not None:
+            pooled.owner = owner
+        self.refill()
+        return pooled
+
+    #Gives a checked out connection back, the owner gets no more of its events
+    async def release(self, pooled):
+        pooled.owner = None
+        if pooled.closed or not self.running:
+            await self.close_connection(pooled)
+            return
+
+        pooled.idle_since = self.clock.time()
+        self.idle.append(pooled)
+        await self.notify()
+
+    #Forgets a connection Deepgram closed
+    async def discard(self, pooled):
+        self.connections.discard(pooled)
+        if pooled in self.idle:
+            self.idle.remove(pooled)
+        await self.notify()
+        self.refill()
+
+    async def close_connection(self, pooled):
+        pooled.owner = None
+        self.connections.discard(pooled)
+        if pooled in self.idle:
+            self.idle.remove(pooled)
+        if not pooled.closed:
+            pooled.closed = True
+            try:
+                await pooled.connection.finish()
+            except Exception as e:
+                print(f"Could not close socket: {e}")
+        await self.notify()
+
+    #Closes connections that have been idle for idle_timeout, oldest first, down to warm of them
+    async def close_expired(self):
+        current_time = self.clock.time()
+        while len(self.idle) > self.warm and current_time - self.idle[0].idle_since > self.idle_timeout:
+            await self.close_connection(self.idle[0])
+        self.refill()
+
+    async def maintain(self):
+        while self.running:
+            await asyncio.sleep(min(self.idle_timeout, 5))
+            await self.close_expired()
+
+    #Closes the idle connections, checked out ones are closed when they are released
+    async def close(self):
+        self.running = False
+        for pooled in list(self.idle):
+            await self.close_connection(pooled)
+        await self.notify()
@@ -1,186 +1,357 @@
 #Default libraries
 import asyncio
 from asyncio import Queue
-from enum import Enum
-import time
+from collections import deque
 
 #3rd party libraries
 from discord.sinks.core import Filters, Sink, default_filters
-from deepgram import (
-    DeepgramClient,
-    DeepgramClientOptions,
-    LiveTranscriptionEvents,
-    LiveOptions,
-)
+from deepgram import LiveOptions
 
-class Speaker():
-    class SpeakerState(Enum):
-        RUNNING = 1
-        TRANSCRIBE = 2
-        FINALIZE = 3
-        STOP = 4
+from sinks.audio import pcm_rms
+from sinks.clock import SystemClock
+from sinks.deepgram_pool import DeepgramPool
+from sinks.events import UtteranceEvents
+from sinks.ingest import DROP_SILENCE, IngestQueue
+from sinks.latency import LatencyTracker
+from sinks.upstream import upstreams
+
+#Discord sends 48 kHz stereo int16
+discord_bytes_per_second = 48000 * 2 * 2
+
+#Seconds past utterance_end to wait for Deepgram's answer to a finalize, the utterance is finished without it after that
+finalize_grace = 1.0
 
-    def __init__(self, loop : asyncio.BaseEventLoop, out_queue : Queue, deepgram_API_key, sentence_end=300, utterance_end=1000):   
+#Put in a speaker's outbox after the audio, deep_stream finalizes the utterance, finishes it or closes the stream when it gets to them
+FINALIZE = "finalize"
+FINISH = "finish"
+STOP = "stop"
+markers = (FINALIZE, FINISH, STOP)
+
+def is_marker(item):
+    return any(item is marker for marker in markers)
+
+class Speaker():
+    def __init__(self, loop : asyncio.BaseEventLoop, out_queue : Queue, pool : DeepgramPool, sentence_end=300, utterance_end=1000, latency : LatencyTracker = None, clock=None, release_after=60, frame_bytes=discord_bytes_per_second // 10, max_outbox_bytes=discord_bytes_per_second * 10):   
         self.loop = loop
         self.queue = out_queue
+        self.latency = latency
+        self.clock = clock if clock is not None else SystemClock()
 
-        self.deepgram_API_key = deepgram_API_key
+        #Connections are checked out of the pool, the one in use is in connection
+        self.pool = pool
+        self.connection = None
 
         self.sentence_end = sentence_end
         self.utterance_end = utterance_end
         
         self.user = None
-        self.data = []
+        self.events = None
+
+        #Audio to send and FINALIZE/FINISH/STOP, deep_stream wakes up as soon as something is put in.
+        #Past max_outbox_bytes of audio the oldest is dropped, so a slow or missing connection can't pile it up
+        self.outbox = deque()
+        self.outbox_event = asyncio.Event()
+        self.outbox_bytes = 0
+        self.max_outbox_bytes = max_outbox_bytes
+        self.dropped = 0
+        #Audio already queued is joined into sends of up to frame_bytes
+        self.frame_bytes = frame_bytes
+        #Taken out of the outbox but didn't fit in the last send
+        self.held = None
 
-        self.new_bytes = False
         self.last_byte = 0       
 
-        self.silent_packet = b"\x00" * 320
+        #Nothing is sent while the speaker is quiet, the connection's keepalive keeps it open.
+        #sentence_end after the last packet Deepgram is told to finalize, utterance_end after it the utterance is finished here
+        self.finalized = False
+        self.finished = False
+        #Finalize was sent and its result hasn't come back yet, finishing waits for it
+        self.awaiting_finalize = False
+        self.finish_pending = False
 
-        self.state = self.SpeakerState.RUNNING    
+        #Seconds of silence after an utterance before the connection goes back to the pool
+        self.release_after = release_after
+        #Until the first interim result, for measuring how long a new speaker waits for the connection
+        self.joined = None
+
+        #When the current utterance went through each stage in sinks.latency.STAGES, sent out with the finish event
+        self.timestamps = {}
+
+        #Final transcripts of the current utterance, joined and sent out when Deepgram says it ended
+        self.is_finals = []
+
+        #deep_stream is over, the sink drops the speaker and the next packet starts a new one
+        self.ended = False
         
     def add_user(self, user):
         self.user = user
+        self.events = UtteranceEvents(user)
+        self.joined = self.clock.time()
         self.loop.create_task(self.deep_stream())
 
-    def add_data(self, data, current_time):
-        self.data.append(data)
-        self.new_bytes = True
+    def add_data(self, data, current_time, arrival):
+        #Deepgram never answered the last finalize, don't mix the next utterance into it
+        if self.finish_pending:
+            self.finish_utterance()
+        self.timestamps.setdefault("packet", arrival)
+        self.put(data)
         self.last_byte = current_time
-
-    def add_silence(self):
-        self.data.append(self.silent_packet)
-
-    def reset_data(self):
-        self.data = []
-        self.new_bytes = False
+        self.finalized = False
+        self.finished = False
+
+    def finalize(self):
+        self.put(FINALIZE)
+        self.finalized = True
+
+    def finish(self):
+        self.put(FINISH)
+        self.finished = True
+
+    def stop(self):
+        self.put(STOP)
+
+    def put(self, item):
+        self.outbox.append(item)
+        if not is_marker(item):
+            self.outbox_bytes += len(item)
+            while self.outbox_bytes > self.max_outbox_bytes and self.drop_oldest():
+                pass
+        self.outbox_event.set()
+
+    #Drops the oldest audio in the outbox, the markers stay where they are
+    def drop_oldest(self):
+        for index, item in enumerate(self.outbox):
+            if not is_marker(item):
+                del self.outbox[index]
+                self.outbox_bytes -= len(item)
+                self.dropped += 1
+                return True
+        return False
+
+    def take(self):
+        item = self.outbox.popleft()
+        if not is_marker(item):
+            self.outbox_bytes -= len(item)
+        return item
+
+    # Earliest time the sink has to act on this speaker without new audio
+    def next_deadline(self):
+        if self.finished:
+            return self.last_byte + self.release_after
+        if self.finalized:
+            return self.last_byte + self.utterance_end / 1000
+        return self.last_byte + self.sentence_end / 1000
+
+    async def next_item(self):
+        if self.held is not None:
+            item, self.held = self.held, None
+            return item
+        while not self.outbox:
+            self.outbox_event.clear()
+            await self.outbox_event.wait()
+        return self.take()
+
+    #Joins the audio that is already waiting into one send, stops at a FINALIZE/FINISH/STOP or at frame_bytes
+    def take_frame(self, chunk):
+        chunks = [chunk]
+        length = len(chunk)
+        while length < self.frame_bytes and self.outbox:
+            item = self.take()
+            if is_marker(item) or length + len(item) > self.frame_bytes:
+                self.held = item
+                break
+            chunks.append(item)
+            length += len(item)
+        return b"".join(chunks)
+
+    #Handlers for this speaker's Deepgram connection, client is the connection that got the message
+    async def on_open(self, client, open, **kwargs):
+        print("Connection Open")
+
+    async def on_message(self, client, result, **kwargs):
+        sentence = result.channel.alternatives[0].transcript
+        from_finalize = getattr(result, "from_finalize", False)
+        if from_finalize:
+            self.awaiting_finalize = False
+        if len(sentence) == 0:
+            if from_finalize and self.finish_pending:
+                self.finish_utterance()
+            return
+        if result.is_final:
+            self.is_finals.append(sentence)
+            if result.speech_final:
+                utterance = " ".join(self.is_finals)
+                print(f"Speech Final: {utterance}")                      
+            else:
+                print(f"Is Final: {sentence}")
+            if from_finalize and self.finish_pending:
+                self.finish_utterance()
+        else:
+            print(f"Interim Results: {sentence}")
+            self.first_interim()
+            #The interim result only covers what hasn't been finalized yet
+            utterance = " ".join(self.is_finals + [sentence])
+            event = self.events.progress(utterance)
+            if event is not None:
+                await self.queue.put(event)
+
+    def first_interim(self):
+        current_time = self.clock.time()
+        if "first_interim" not in self.timestamps and "packet" in self.timestamps:
+            self.timestamps["first_interim"] = current_time
+        if self.joined is not None:
+            if self.latency is not None:
+                self.latency.observe("new speaker first interim", current_time - self.joined)
+            self.joined = None
+
+    async def on_metadata(self, client, metadata, **kwargs):
+        print(f"Metadata: {metadata}")
+
+    async def on_speech_started(self, client, speech_started, **kwargs):
+        print("Speech Started")
+        
+    async def on_utterance_end(self, client, utterance_end, **kwargs):               
+        print("Utterance End")
+        self.finish_utterance()
+
+    #Deepgram may never answer a finalize, the utterance is finished anyway once finalize_grace passes
+    async def finish_after_grace(self, events):
+        await asyncio.sleep(finalize_grace)
+        if self.finish_pending and self.events is events:
+            print("No answer to finalize, finishing the utterance without it")
+            self.finish_utterance()
+
+    #Sends out the finals of the utterance as its finish event, once either Deepgram or the packet gap says it ended
+    #Without any finals (noise, or an empty finalize) nothing is sent, but the next utterance still starts over
+    def finish_utterance(self):
+        self.finish_pending = False
+        timestamps = self.timestamps
+        events = self.events
+        self.timestamps = {}
+        self.events = UtteranceEvents(self.user)
+        if len(self.is_finals) > 0:
+            utterance = " ".join(self.is_finals)
+            print(f"Utterance End: {utterance}")
+            timestamps["finish"] = self.clock.time()
+            if self.latency is not None:
+                self.latency.record(timestamps)
+            self.queue.put_nowait(events.finish(utterance, timestamps))
+            self.is_finals = []
+
+    async def on_close(self, client, close, **kwargs):
+        print("Connection Closed")
+
+    async def on_error(self, client, error, **kwargs):
+        print(f"Handled Error: {error}")
+
+    async def on_unhandled(self, client, unhandled, **kwargs):
+        print(f"Unhandled Websocket Message: {unhandled}")
 
     async def deep_stream(self):
-        global is_finals
-        global queue
-        global user
-
-        user = self.user
-        queue = self.queue
-        is_finals = []
-
         try:
-            config: DeepgramClientOptions = DeepgramClientOptions(
-                options={"keepalive": "true"},
-            )
-            deepgram: DeepgramClient = DeepgramClient(self.deepgram_API_key, config)
-            dg_connection = deepgram.listen.asyncwebsocket.v("1")
-
-            async def on_open(self, open, **kwargs):
-                print("Connection Open")
-
-            async def on_message(self, result, **kwargs):
-                global is_finals
-                global queue
-                sentence = result.channel.alternatives[0].transcript
-                if len(sentence) == 0:
-                    return
-                if result.is_final:
-                    is_finals.append(sentence)
-                    if result.speech_final:
-                        utterance = " ".join(is_finals)
-                        print(f"Speech Final: {utterance}")                      
-                    else:
-                        print(f"Is Final: {sentence}")
-                else:
-                    print(f"Interim Results: {sentence}")
-                    await queue.put({"user" : user, "result" : utterance, "type":"progress"})
-
-            async def on_metadata(self, metadata, **kwargs):
-                print(f"Metadata: {metadata}")
-
-            async def on_speech_started(self, speech_started, **kwargs):
-                print("Speech Started")
-                
-            async def on_utterance_end(self, utterance_end, **kwargs):               
-                global is_finals
-                global queue
-                global user
-
-                print("Utterance End")
-
-                if len(is_finals) > 0:
-                    utterance = " ".join(is_finals)
-                    print(f"Utterance End: {utterance}")
-                    await queue.put({"user" : user, "result" : utterance, "type":"finish"})
-                    is_finals = []
-
-            async def on_close(self, close, **kwargs):
-                print("Connection Closed")
-
-            async def on_error(self, error, **kwargs):
-                print(f"Handled Error: {error}")
-
-            async def on_unhandled(self, unhandled, **kwargs):
-                print(f"Unhandled Websocket Message: {unhandled}")
-
-            dg_connection.on(LiveTranscriptionEvents.Open, on_open)
-            dg_connection.on(LiveTranscriptionEvents.Transcript, on_message)
-            dg_connection.on(LiveTranscriptionEvents.Metadata, on_metadata)
-            dg_connection.on(LiveTranscriptionEvents.SpeechStarted, on_speech_started)
-            dg_connection.on(LiveTranscriptionEvents.UtteranceEnd, on_utterance_end)
-            dg_connection.on(LiveTranscriptionEvents.Close, on_close)
-            dg_connection.on(LiveTranscriptionEvents.Error, on_error)
-            dg_connection.on(LiveTranscriptionEvents.Unhandled, on_unhandled)
-
-            # connect to websocket
-            options: LiveOptions = LiveOptions(
-                model="nova-2",
-                language="en-US",
-                smart_format=True,
-                encoding="linear16",
-                channels=2,
-                sample_rate=48000,
-                interim_results=True,
-                utterance_end_ms=f"{self.utterance_end}", #cannot be less than 1000ms
-                vad_events=True,
-                endpointing=self.sentence_end,
-            )
-
-            addons = {
-                "no_delay": "true"
-            }
-
-            if await dg_connection.start(options, addons=addons) is False:
-                print("Failed to connect to Deepgram")
+            self.connection = await self.pool.acquire(self)
+            if self.connection is None:
                 return
 
-            while self.state != self.SpeakerState.STOP:
-                if self.state == self.SpeakerState.TRANSCRIBE:
-                    await dg_connection.send(b"".join(self.data))
-                    self.reset_data()
-                    self.state = self.SpeakerState.RUNNING
-                    
-                elif self.state == self.SpeakerState.FINALIZE:
-                    await dg_connection.finalize()
-                    self.reset_data()
-                    self.state = self.SpeakerState.RUNNING
+            while True:
+                item = await self.next_item()
+                if item is STOP:
+                    break
+
+                #Deepgram closed the connection, get another one
+                if self.connection.closed:
+                    await self.pool.release(self.connection)
+                    self.connection = await self.pool.acquire(self)
+                    if self.connection is None:
+                        return
+
+                upstream = self.connection.upstream
+                if item is FINALIZE:
+                    #Audio the encoder held back has to go out before Deepgram finalizes
+                    tail = upstream.flush()
+                    if tail:
+                        await self.connection.connection.send(tail)
+                    self.awaiting_finalize = True
+                    await self.connection.connection.finalize()
+                elif item is FINISH:
+                    #The finalize result may still be on its way, it finishes the utterance when it arrives
+                    if self.awaiting_finalize:
+                        self.finish_pending = True
+                        self.loop.create_task(self.finish_after_grace(self.events))
+                    else:
+                        self.finish_utterance()
                 else:
-                    await asyncio.sleep(.005)
-
-            await dg_connection.finish()
-            await asyncio.sleep(1)
+                    data = upstream.encode(self.take_frame(item))
+                    if data:
+                        await self.connection.connection.send(data)
 
         except Exception as e:
-            print(f"Could not open socket: {e}")
-            return
+            print(f"Deepgram stream failed: {e}")
+        finally:
+            #Finals still waiting on a finalize answer go out before the connection is gone
+            if self.finish_pending:
+                self.finish_utterance()
+            if self.connection is not None:
+                await self.pool.release(self.connection)
+                self.connection = None
+            self.ended = True
 
 class DeepgramSink(Sink):
 
     class SinkSettings:
-        def __init__(self, deepgram_API_key,sentence_end = 300,utterence_end = 1000, data_length=25000, max_speakers=-1):   
+        def __init__(self, deepgram_API_key,sentence_end = 300,utterence_end = 1000, data_length=25000, max_speakers=-1, vad_threshold=0.01, ingest_policy=DROP_SILENCE, max_ingest_seconds=10,
+                     deepgram_url="", pool_warm=1, pool_max_size=16, pool_idle_timeout=60, release_after=60, frame_bytes=discord_bytes_per_second // 10, max_outbox_seconds=10,
+                     upstream="mono16k", opus_bitrate=32):   
             self.deepgram_API_key = deepgram_API_key
             self.sentence_end = sentence_end
             self.utterence_end = utterence_end
             self.data_length = data_length
             self.max_speakers = max_speakers
+            #Packets quieter than this are the first to go when the ingest policy is drop_silence
+            self.vad_threshold = vad_threshold
+            #What happens to audio the loop can't keep up with, see sinks.ingest
+            self.ingest_policy = ingest_policy
+            self.max_ingest_seconds = max_ingest_seconds
+            #Connection pool, see sinks.deepgram_pool. deepgram_url can point at a local mock server for testing
+            self.deepgram_url = deepgram_url
+            self.pool_warm = pool_warm
+            self.pool_max_size = pool_max_size
+            self.pool_idle_timeout = pool_idle_timeout
+            #Seconds a speaker can be quiet before its connection goes back to the pool
+            self.release_after = release_after
+            #Seconds of audio a speaker holds while its sends can't keep up, the oldest is dropped past that
+            self.max_outbox_seconds = max_outbox_seconds
+            #Most bytes sent to Deepgram at once, audio that piled up while a send was in flight is joined up to this
+            self.frame_bytes = frame_bytes
+            #How the audio is sent to Deepgram, a name from sinks.upstream.upstreams:
+            #linear16 is discord's 48 kHz stereo as is, mono16k is a sixth of that and opus is opus_bitrate kbit/s
+            self.upstream = upstream
+            self.opus_bitrate = opus_bitrate
+
+        #Makes the encoder for one connection
+        def make_upstream(self):
+            if self.upstream == "opus":
+                return upstreams["opus"](self.opus_bitrate)
+            return upstreams[self.upstream]()
+
+        #What every connection is started with
+        def live_options(self):
+            upstream = upstreams[self.upstream]
+            return LiveOptions(
+                model="nova-2",
+                language="en-US",
+                smart_format=True,
+                encoding=upstream.encoding,
+                channels=upstream.channels,
+                sample_rate=upstream.sample_rate,
+                interim_results=True,
+                utterance_end_ms=f"{self.utterence_end}", #cannot be less than 1000ms
+                vad_events=True,
+                endpointing=self.sentence_end,
+            )
 
-    def __init__(self, *, filters=None, sink_settings : SinkSettings, queue : asyncio.Queue, loop : asyncio.AbstractEventLoop):
+    #clock is where the sink gets the time from, pass a sinks.clock.VirtualClock to simulate the timeouts faster than real time
+    def __init__(self, *, filters=None, sink_settings : SinkSettings, queue : asyncio.Queue, loop : asyncio.AbstractEventLoop, clock=None):
         if filters is None:
             filters = default_filters
         self.filters = filters
@@ -189,62 +360,100 @@ class DeepgramSink(Sink):
         self.sink_settings = sink_settings
         self.queue = queue
         self.loop = loop
+        self.clock = clock if clock is not None else SystemClock()
    
         self.vc = None
 
         self.running = True  
 
-        self.voice_queue = Queue()
-        self.speakers = []
+        #Per stage latency histograms of finished utterances
+        self.latency = LatencyTracker()
+
+        #write() puts audio in voice_queue from discord's decoder thread and sets voice_event to wake the loop.
+        #voice_queue is bounded per speaker, so a loop that falls behind loses audio instead of memory.
+        self.voice_queue = IngestQueue(max_packets=sink_settings.max_ingest_seconds * 50,
+                                       max_length=sink_settings.max_ingest_seconds * discord_bytes_per_second,
+                                       policy=sink_settings.ingest_policy)
+        self.voice_event = asyncio.Event()
+        #Speakers keyed by user id
+        self.speakers = {}
+
+        #Opens connections before anyone talks, new speakers check one out instead of connecting
+        self.pool = DeepgramPool(sink_settings.deepgram_API_key,
+                                 sink_settings.live_options(),
+                                 {"no_delay": "true"},
+                                 upstream=sink_settings.make_upstream,
+                                 url=sink_settings.deepgram_url,
+                                 warm=sink_settings.pool_warm,
+                                 max_size=sink_settings.pool_max_size,
+                                 idle_timeout=sink_settings.pool_idle_timeout,
+                                 loop=self.loop,
+                                 clock=self.clock)
+        self.pool.start()
         self.loop.create_task(self.insert_voice()) 
 
+    # Sleeps until write() hands over audio or the next speaker deadline passes, an idle sink uses no CPU
+    async def wait_for_voice(self):
+        deadlines = [speaker.next_deadline() for speaker in self.speakers.values()]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        timeout = None
+        if deadlines:
+            timeout = max(min(deadlines) - self.clock.time(), 0)
+
+        if not await self.clock.wait_event(self.voice_event, timeout):
+            return []
+
+        self.voice_event.clear()
+        return self.voice_queue.drain()
+
     async def insert_voice(self):
 
         while self.running:
-            
-            current_time = time.time()
-            if not self.voice_queue.empty():  
-                #Sorts data from queue for each speaker after each transcription             
-                while not self.voice_queue.empty():                  
-                    item = await self.voice_queue.get()
-
-                    user_exists = False
-                    for speaker in self.speakers:     
-                        if speaker.user is None:
-                            speaker.add_user(item[0])
-                                       
-                        if item[0] == speaker.user:
-                            speaker.add_data(item[1], current_time)                          
-                            user_exists = True
-                            break
-
-                    if not user_exists:
-                        #add new user to speakers
-                        if self.sink_settings.max_speakers < 0 or len(self.speakers) <= self.sink_settings.max_speakers:
-                            self.speakers.append(Speaker(self.loop, 
-                                                         self.queue, 
-                                                         self.sink_settings.deepgram_API_key, 
-                                                         self.sink_settings.sentence_end, 
-                                                         self.sink_settings.utterence_end))
-                            self.speakers[-1].add_user(item[0])
-                            self.speakers[-1].add_data(item[1], current_time)
-            else:  
-                #Loops with no wait time is bad
-                await asyncio.sleep(.02)
-
-            for speaker in self.speakers:
-                #Transcribe when new data is available
-                if speaker.new_bytes:
-                    speaker.state = speaker.SpeakerState.TRANSCRIBE
-                #finalize data if X seconds passes from last data packet from discord
-                elif current_time > speaker.last_byte + speaker.utterance_end/1000:
-                    speaker.state = speaker.SpeakerState.FINALIZE   
-                #add silence to help process utterance
-                elif  current_time > speaker.last_byte + speaker.sentence_end/1000:
-                    speaker.add_silence()
+            items = await self.wait_for_voice()
+
+            current_time = self.clock.time()
+            #Sorts data from queue for each speaker after each transcription
+            for user, data, arrival in items:
+                speaker = self.speakers.get(user)
+                if speaker is not None:
+                    speaker.add_data(data, current_time, arrival)
+                #add new user to speakers
+                elif self.sink_settings.max_speakers < 0 or len(self.speakers) < self.sink_settings.max_speakers:
+                    speaker = Speaker(self.loop, 
+                                      self.queue, 
+                                      self.pool, 
+                                      self.sink_settings.sentence_end, 
+                                      self.sink_settings.utterence_end,
+                                      self.latency,
+                                      self.clock,
+                                      self.sink_settings.release_after,
+                                      self.sink_settings.frame_bytes,
+                                      self.sink_settings.max_outbox_seconds * discord_bytes_per_second)
+                    speaker.add_user(user)
+                    speaker.add_data(data, current_time, arrival)
+                    self.speakers[user] = speaker
+
+            for user, speaker in list(self.speakers.items()):
+                gap = current_time - speaker.last_byte
+                #Got no connection or lost it, its audio is gone. The next packet from the user starts a new speaker
+                if speaker.ended:
+                    del self.speakers[user]
+                #Quiet for long enough, give the connection back to the pool
+                elif speaker.finished and gap > speaker.release_after:
+                    speaker.stop()
+                    del self.speakers[user]
+                elif speaker.finished:
+                    continue
+                #The utterance is over if X seconds pass from the last data packet from discord
+                elif speaker.finalized and gap > speaker.utterance_end/1000:
+                    speaker.finish()
+                #Have Deepgram finalize what it heard once the speaker pauses, instead of padding the stream with silence
+                elif not speaker.finalized and gap > speaker.sentence_end/1000:
+                    speaker.finalize()
         
-        for speaker in self.speakers:     
-            speaker.state = speaker.SpeakerState.STOP
+        for speaker in self.speakers.values():
+            speaker.stop()
+        await self.pool.close()
 
     #Gets audio data from discord for each user talking
     @Filters.container
@@ -253,10 +462,17 @@ class DeepgramSink(Sink):
         if data_len > self.sink_settings.data_length:
             data = data[-self.sink_settings.data_length+int(self.sink_settings.data_length/10):]
         
-        #Send bytes to be transcribed
-        self.voice_queue.put_nowait([user, data])
+        #Send bytes to be transcribed, write() is called from discord's decoder thread so only wake the loop safely when it has nothing queued
+        silent = pcm_rms(data) < self.sink_settings.vad_threshold
+        if self.voice_queue.put(user, data, silent, self.clock.time()):
+            self.loop.call_soon_threadsafe(self.voice_event.set)
+
+    #Packets the ingest policy or a full outbox has thrown away for each user, for monitoring
+    def stats(self):
+        return {user : {"dropped" : self.voice_queue.dropped(user) + speaker.dropped} for user, speaker in list(self.speakers.items())}
 
     #End thread
     def close(self):
         self.running = False
+        self.loop.call_soon_threadsafe(self.voice_event.set)
         self.queue.put_nowait(None)
\ No newline at end of file
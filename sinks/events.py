@@ -0,0 +1,91 @@
+# Default libraries
+import itertools
+import os
+
+# Event types, in the order an utterance goes through them
+PROGRESS = "progress"  # The transcription so far changed
+PREFINISH = "prefinish"  # The speaker paused, the text may be final
+FINISH = "finish"  # The utterance is over, result is final
+
+# Utterance ids are unique within a run of the bot
+utterance_ids = itertools.count(1)
+
+
+class TranscriptionEvent:
+    """What the sinks put on their queue, one update about one utterance.\n
+
+    type - PROGRESS, PREFINISH or FINISH\n
+    user - Discord user id of the speaker\n
+    utterance - Id of the utterance, the same for every event of it\n
+    sequence - Counts the events of the utterance from 1, so gaps and reordering can be noticed\n
+    result - The whole text of the utterance so far\n
+    offset, suffix - For progress, the text changed from offset on and is now suffix. result == previous result[:offset] + suffix\n
+    timestamps - For finish, when the utterance went through each stage in sinks.latency.STAGES\n
+    """
+
+    __slots__ = ("type", "user", "utterance", "sequence", "result", "offset", "suffix", "timestamps")
+
+    def __init__(self, type, user, utterance, sequence, result, offset=0, suffix=None, timestamps=None):
+        self.type = type
+        self.user = user
+        self.utterance = utterance
+        self.sequence = sequence
+        self.result = result
+        self.offset = offset
+        self.suffix = suffix if suffix is not None else result
+        self.timestamps = timestamps
+
+    def __repr__(self):
+        return f"TranscriptionEvent({self.type} {self.user} #{self.utterance}.{self.sequence} {self.result!r})"
+
+    # Compact form for sending over a socket, progress only carries what changed
+    def to_dict(self):
+        data = {"type": self.type, "user": self.user, "id": self.utterance, "seq": self.sequence}
+        if self.type == PROGRESS:
+            data["offset"] = self.offset
+            data["text"] = self.suffix
+        else:
+            data["text"] = self.result
+        return data
+
+
+# Rebuilds the text from the previous text and a progress event, or its to_dict() form
+def apply_progress(text, offset, suffix):
+    return text[:offset] + suffix
+
+
+class UtteranceEvents:
+    """Makes the events for one utterance of one speaker.\n
+
+    progress() returns None when the text hasn't changed since the last event, so unchanged decodes send nothing.\n
+    prefinish() returns None when the text is the same as the last prefinish.\n
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.utterance = next(utterance_ids)
+        self.sequence = 0
+        self.sent = ""
+        self.prefinished = None
+
+    def event(self, type, result, **kwargs):
+        self.sequence += 1
+        return TranscriptionEvent(type, self.user, self.utterance, self.sequence, result, **kwargs)
+
+    def progress(self, text):
+        if text == self.sent:
+            return None
+        offset = len(os.path.commonprefix([self.sent, text]))
+        self.sent = text
+        return self.event(PROGRESS, text, offset=offset, suffix=text[offset:])
+
+    def prefinish(self, text):
+        if text == self.prefinished:
+            return None
+        self.sent = text
+        self.prefinished = text
+        return self.event(PREFINISH, text)
+
+    def finish(self, text, timestamps=None):
+        self.sent = text
+        return self.event(FINISH, text, timestamps=timestamps)
@@ -0,0 +1,111 @@
+# Default libraries
+import threading
+import time
+from collections import deque
+
+# What to do when a speaker's queued audio is over its limit
+COALESCE = "coalesce"
+DROP_OLDEST = "drop_oldest"
+DROP_SILENCE = "drop_silence"
+
+
+class IngestQueue:
+    """Bounded hand over of audio from discord's decoder thread to a sink's transcription loop.\n
+
+    Every speaker gets their own queue of packets, limited to max_packets packets and max_length audio (len() of the packets).\n
+    When a speaker goes over, the policy decides what goes:\n
+    coalesce - Their packets are joined into one, and only if that is still too long is the oldest audio cut off\n
+    drop_oldest - Their oldest packets are dropped\n
+    drop_silence - Their oldest silent packets are dropped first, then their oldest packets\n
+    Every dropped or cut packet is counted for its user in drops.\n
+    drain() also returns when each user's oldest waiting packet arrived, for latency tracking.\n
+
+    Safe to use from several threads.\n
+    """
+
+    def __init__(self, *, max_packets=250, max_length=None, policy=DROP_SILENCE, join=b"".join):
+        if policy not in (COALESCE, DROP_OLDEST, DROP_SILENCE):
+            raise ValueError(f"Unknown ingest policy: {policy}")
+
+        self.max_packets = max_packets
+        self.max_length = max_length
+        self.policy = policy
+        self.join = join
+
+        self.lock = threading.Lock()
+        # Packets and their silent flag for each user, the total length of each user's packets, and when their first one arrived
+        self.packets = {}
+        self.lengths = {}
+        self.arrivals = {}
+        self.drops = {}
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(packets) for packets in self.packets.values())
+
+    # Returns True if the queue was empty, the consumer only needs waking up then
+    def put(self, user, data, silent=False, arrival=None):
+        with self.lock:
+            was_empty = not self.packets
+            self.arrivals.setdefault(user, arrival if arrival is not None else time.time())
+            packets = self.packets.setdefault(user, deque())
+            packets.append((data, silent))
+            self.lengths[user] = self.lengths.get(user, 0) + len(data)
+            self.enforce(user)
+            return was_empty
+
+    def over_limit(self, user):
+        if len(self.packets[user]) > self.max_packets:
+            return True
+        return self.max_length is not None and self.lengths[user] > self.max_length
+
+    def enforce(self, user):
+        packets = self.packets[user]
+        if not self.over_limit(user):
+            return
+
+        if self.policy == COALESCE:
+            data = self.join([packet for packet, silent in packets])
+            silent = all(silent for packet, silent in packets)
+            if self.max_length is not None and len(data) > self.max_length:
+                data = data[-self.max_length :]
+                self.count_drop(user)
+            packets.clear()
+            packets.append((data, silent))
+            self.lengths[user] = len(data)
+            return
+
+        if self.policy == DROP_SILENCE:
+            while self.over_limit(user):
+                index = next(
+                    (index for index, (data, silent) in enumerate(packets) if silent),
+                    None,
+                )
+                if index is None:
+                    break
+                data, silent = packets[index]
+                del packets[index]
+                self.lengths[user] -= len(data)
+                self.count_drop(user)
+
+        while len(packets) > 1 and self.over_limit(user):
+            data, silent = packets.popleft()
+            self.lengths[user] -= len(data)
+            self.count_drop(user)
+
+    def count_drop(self, user):
+        self.drops[user] = self.drops.get(user, 0) + 1
+
+    # Takes everything queued, one (user, data, arrival) item per user with their packets joined, in the order users started queueing
+    def drain(self):
+        with self.lock:
+            packets, self.packets, self.lengths = self.packets, {}, {}
+            arrivals, self.arrivals = self.arrivals, {}
+        return [
+            (user, self.join([packet for packet, silent in queued]), arrivals[user])
+            for user, queued in packets.items()
+        ]
+
+    def dropped(self, user):
+        with self.lock:
+            return self.drops.get(user, 0)
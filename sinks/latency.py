@@ -0,0 +1,113 @@
+# Default libraries
+import threading
+
+# Points in an utterance's life that get a timestamp, in the order they happen.
+# The sinks fill in packet to finish, the bot scripts fill in the rest.
+STAGES = [
+    "packet",  # First packet of the utterance reached write()
+    "first_interim",  # First interim result came back, deepgram only
+    "decode_start",  # Last transcription of the utterance started
+    "decode_end",  # Last transcription of the utterance finished
+    "prefinish",  # Prefinish event was sent after the last transcription
+    "finish",  # Finish event was sent
+    "pickup",  # whisper_message took the finish event off the queue
+    "llm_done",  # LLM answer is ready
+    "tts_done",  # TTS audio is ready
+    "playback",  # Answer started playing in discord
+]
+
+# Upper bounds of the histogram buckets in milliseconds, the last bucket takes everything slower
+BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        bucket = 0
+        while bucket < len(BUCKETS_MS) and ms > BUCKETS_MS[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    # Upper bound of the bucket the percentile falls in (or the max if that's lower), so it overestimates by at most one bucket
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0.0
+        target = self.count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if bucket < len(BUCKETS_MS):
+                    return min(BUCKETS_MS[bucket], self.max)
+                return self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max,
+        }
+
+
+class LatencyTracker:
+    """Per stage latency histograms for finished utterances.\n
+
+    record() takes an utterance's timestamps (stage name to time.time()) and adds the time between every stage and the one recorded before it.\n
+    Stages that weren't recorded are skipped, and "total" covers the first stage to the last.\n
+    Safe to use from several threads.\n
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def record(self, timestamps):
+        stages = [stage for stage in STAGES if stage in timestamps]
+        if len(stages) < 2:
+            return
+
+        with self.lock:
+            for previous, stage in zip(stages, stages[1:]):
+                self.add(f"{previous} -> {stage}", timestamps[stage] - timestamps[previous])
+            self.add("total", timestamps[stages[-1]] - timestamps[stages[0]])
+
+    # A measurement that isn't between two stages of an utterance
+    def observe(self, name, seconds):
+        with self.lock:
+            self.add(name, seconds)
+
+    def add(self, name, seconds):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].add(max(seconds, 0.0))
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    # Plain text table for printing or sending in a discord message
+    def report(self):
+        summary = self.summary()
+        if not summary:
+            return "No utterances recorded yet"
+
+        lines = [f"{'stage':<28}{'count':>6}{'mean':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}"]
+        for name, stats in summary.items():
+            lines.append(
+                f"{name:<28}{stats['count']:>6}{stats['mean_ms']:>8.0f}{stats['p50_ms']:>8.0f}"
+                f"{stats['p90_ms']:>8.0f}{stats['p99_ms']:>8.0f}{stats['max_ms']:>8.0f}"
+            )
+        return "\n".join(lines)
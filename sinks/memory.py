@@ -0,0 +1,33 @@
+# Default libraries
+import threading
+
+
+class MemoryBudget:
+    """Caps the audio buffered by every sink that shares it, for example all the guilds one bot is in.\n
+
+    Each sink reports how many bytes its speakers hold with update(), and finalizes its speakers early while exceeded() is True.\n
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.usage = {}
+
+    def update(self, owner, nbytes):
+        with self.lock:
+            self.usage[owner] = nbytes
+
+    def release(self, owner):
+        with self.lock:
+            self.usage.pop(owner, None)
+
+    def total(self):
+        with self.lock:
+            return sum(self.usage.values())
+
+    def exceeded(self):
+        return self.max_bytes > 0 and self.total() > self.max_bytes
+
+
+# Shared by every sink in the process unless they are given their own
+process_memory_budget = MemoryBudget(256 * 1024 * 1024)
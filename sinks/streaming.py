@@ -0,0 +1,64 @@
+# Default libraries
+import re
+
+
+# A single transcribed word, start and end are seconds from the start of the audio that was decoded
+class Word:
+    def __init__(self, text, start, end):
+        self.text = text
+        self.start = start
+        self.end = end if end is not None else start
+
+
+# A transcribed segment with its words, the scores are None when the backend doesn't provide them
+class Segment:
+    def __init__(
+        self,
+        text,
+        start,
+        end,
+        words,
+        avg_logprob=None,
+        no_speech_prob=None,
+        compression_ratio=None,
+    ):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.words = words
+        self.avg_logprob = avg_logprob
+        self.no_speech_prob = no_speech_prob
+        self.compression_ratio = compression_ratio
+
+
+def words_to_text(words):
+    return "".join(word.text for word in words)
+
+
+class LocalAgreement:
+    """Decides which words of a streaming transcription are stable enough to commit.\n
+
+    Whisper re-transcribes a speaker's buffer on every decode, and the end of each hypothesis is still unstable.\n
+    A word is committed once two consecutive hypotheses agree on it and on everything before it.\n
+    After that its audio can be dropped from the buffer and its text used as the prompt for the next decode.\n
+    """
+
+    def __init__(self):
+        # Words of the last hypothesis that have not been committed yet
+        self.pending = []
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r"[^\w']", "", text).lower()
+
+    # Takes the words of the latest hypothesis and returns the ones that are now committed
+    def insert(self, words):
+        agreed = 0
+        for new, old in zip(words, self.pending):
+            if self.normalize(new.text) != self.normalize(old.text):
+                break
+            agreed += 1
+
+        self.pending = words[agreed:]
+        return words[:agreed]
+
@@ -0,0 +1,122 @@
+# Default libraries
+import re
+import zlib
+
+
+def normalize_phrase(text):
+    return " ".join(re.sub(r"[.!?,]", "", text).lower().split())
+
+
+# Whisper returns these from silence or noise, mostly youtube commentary it was trained on.
+# Stored normalized in a set so a lookup costs the same however long the list gets.
+excluded_phrases = frozenset(
+    normalize_phrase(phrase)
+    for phrase in [
+        "",
+        "thanks",
+        "tch",
+        "thank you so much thank you",
+        "for more information on covid-19 vaccines visit our website",
+        "thank you very much",
+        "we'll be right back",
+        "subs by www.zeoranger.co.uk",
+        "hello everyone",
+        "thank you bye",
+        "thank you",
+        "all right",
+        "thank you thank you",
+        "thank you for watching",
+        "thanks for watching",
+        "i'll see you next time",
+        "got to cancel",
+        "shh",
+        "wow",
+        "shhh",
+        "hello",
+        "you",
+        "the",
+        "yeah",
+        "but",
+        "heh heh",
+        "heh",
+        "bye",
+        "okay",
+        "silence",
+    ]
+)
+
+
+# Same measure whisper uses, repetitive text compresses well
+def compression_ratio(text):
+    data = text.encode("utf-8")
+    if not data:
+        return 0.0
+    return len(data) / len(zlib.compress(data))
+
+
+class HallucinationFilter:
+    """Drops transcriptions that are most likely whisper hallucinations before they reach the LLM.\n
+
+    Every hallucinated "thank you" passed on costs a full LLM call and a TTS synthesis.\n
+
+    Inputs:\n
+    log_prob_threshold - Segments with a lower average log probability are dropped\n
+    no_speech_threshold - Only the low log probability segments whisper also thinks are silence are dropped, when the backend reports it\n
+    compression_ratio_threshold - Segments that compress better than this are repeating themselves\n
+    max_repeats - Segments that say the same 1 to 4 words more than this many times in a row are dropped\n
+    excluded - Whole transcriptions that are ignored, normalized with normalize_phrase\n
+    """
+
+    def __init__(
+        self,
+        *,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6,
+        compression_ratio_threshold=2.4,
+        max_repeats=3,
+        excluded=excluded_phrases,
+    ):
+        self.log_prob_threshold = log_prob_threshold
+        self.no_speech_threshold = no_speech_threshold
+        self.compression_ratio_threshold = compression_ratio_threshold
+        self.max_repeats = max_repeats
+        self.excluded = excluded
+
+    def is_excluded(self, text):
+        return normalize_phrase(text) in self.excluded
+
+    def has_repeats(self, text):
+        words = normalize_phrase(text).split()
+        for size in range(1, 5):
+            for start in range(len(words) - size + 1):
+                gram = words[start : start + size]
+                repeats = 1
+                index = start + size
+                while words[index : index + size] == gram:
+                    repeats += 1
+                    index += size
+                if repeats > self.max_repeats:
+                    return True
+        return False
+
+    # Scores are None for backends that don't provide them. Those checks are skipped, except the compression ratio which is computed from the text
+    def is_hallucination(self, segment):
+        # The same check whisper skips silent segments with, a high no_speech_prob that got this far came with a confident log probability.
+        # Without a no_speech_prob the low log probability is enough
+        if (
+            segment.avg_logprob is not None
+            and segment.avg_logprob < self.log_prob_threshold
+            and (segment.no_speech_prob is None or segment.no_speech_prob > self.no_speech_threshold)
+        ):
+            return True
+
+        ratio = segment.compression_ratio
+        if ratio is None:
+            ratio = compression_ratio(segment.text)
+        if ratio > self.compression_ratio_threshold:
+            return True
+
+        return self.has_repeats(segment.text)
+
+    def filter(self, segments):
+        return [segment for segment in segments if not self.is_hallucination(segment)]
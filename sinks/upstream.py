@@ -0,0 +1,169 @@
+# Default libraries
+import random
+import struct
+
+# 3rd party libraries
+import numpy as np
+from discord.opus import Encoder
+
+from sinks.audio import Resampler
+
+
+class PCMUpstream:
+    """Sends discord's audio to Deepgram as it is, linear16 48 kHz stereo, about 1.5 Mbit/s.\n
+
+    Every upstream has encode(), which turns discord PCM into the bytes to send and may hold some back,
+    and flush(), which returns whatever is held back before a finalize.\n
+    encoding, sample_rate and channels are what the connection tells Deepgram to expect.\n
+    """
+
+    encoding = "linear16"
+    sample_rate = 48000
+    channels = 2
+
+    def encode(self, pcm):
+        return pcm
+
+    def flush(self):
+        return b""
+
+
+class MonoUpstream(PCMUpstream):
+    """Downmixes discord's audio to linear16 16 kHz mono, a sixth of the bytes of PCMUpstream at about 256 kbit/s.\n"""
+
+    sample_rate = 16000
+    channels = 1
+
+    def __init__(self):
+        self.resampler = Resampler(Encoder.SAMPLING_RATE, Encoder.CHANNELS, self.sample_rate)
+
+    def encode(self, pcm):
+        audio = self.resampler.process(pcm)
+        return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+# Ogg's CRC32, polynomial 0x04C11DB7 without bit reflection, unlike zlib.crc32
+def make_ogg_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+ogg_crc_table = make_ogg_crc_table()
+
+
+def ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ ogg_crc_table[(crc >> 24) ^ byte]
+    return crc
+
+
+# Page header up to the segment table: capture pattern, version, flags, granule position, serial, page number, crc, segment count
+ogg_page_format = struct.Struct("<4sBBqIIIB")
+OGG_BOS = 0x02
+
+
+class OggOpusWriter:
+    """Just enough of an Ogg muxer for one Opus stream (RFC 7845): the two header pages, then pages of audio packets.\n"""
+
+    def __init__(self, channels, sampling_rate, pre_skip=312):
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.pre_skip = pre_skip
+        self.serial = random.getrandbits(32)
+        self.sequence = 0
+        # Samples per channel at 48 kHz up to the end of the last page
+        self.granule = 0
+        self.started = False
+
+    def page(self, packets, flags=0):
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+
+        page = bytearray(
+            ogg_page_format.pack(b"OggS", 0, flags, self.granule, self.serial, self.sequence, 0, len(lacing))
+        )
+        page += lacing
+        for packet in packets:
+            page += packet
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+        self.sequence += 1
+        return bytes(page)
+
+    def headers(self):
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, self.channels, self.pre_skip, self.sampling_rate, 0, 0)
+        vendor = b"discord-ai"
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        return self.page([head], OGG_BOS) + self.page([tags])
+
+    # One page for all the packets, each samples long. The header pages go in front of the first call
+    def write(self, packets, samples):
+        data = b""
+        if not self.started:
+            data = self.headers()
+            self.started = True
+        if not packets:
+            return data
+
+        # A page holds at most 255 lacing values, a 20 ms packet takes one or two
+        pages = []
+        group = []
+        segments = 0
+        for packet in packets:
+            packet_segments = len(packet) // 255 + 1
+            if group and segments + packet_segments > 255:
+                pages.append(self.page(group))
+                group = []
+                segments = 0
+            self.granule += samples
+            group.append(packet)
+            segments += packet_segments
+        pages.append(self.page(group))
+        return data + b"".join(pages)
+
+
+class OpusUpstream(PCMUpstream):
+    """Encodes discord's audio to Opus in Ogg pages with discord's own encoder, around bitrate kbit/s.\n
+
+    Opus only takes whole 20 ms frames, the rest of a packet waits for the next encode() and flush() pads it with silence.\n
+    """
+
+    encoding = "opus"
+
+    def __init__(self, bitrate=32):
+        self.encoder = Encoder()
+        self.encoder.set_bitrate(bitrate)
+        self.encoder.set_signal_type("voice")
+        # The websocket doesn't lose packets, no need to spend bits on recovering them
+        self.encoder.set_fec(False)
+
+        self.writer = OggOpusWriter(self.channels, self.sample_rate)
+        self.pending = bytearray()
+
+    def encode(self, pcm):
+        self.pending += pcm
+        packets = []
+        while len(self.pending) >= Encoder.FRAME_SIZE:
+            frame = bytes(self.pending[: Encoder.FRAME_SIZE])
+            del self.pending[: Encoder.FRAME_SIZE]
+            packets.append(self.encoder.encode(frame, Encoder.SAMPLES_PER_FRAME))
+        return self.writer.write(packets, Encoder.SAMPLES_PER_FRAME)
+
+    def flush(self):
+        if not self.pending:
+            return b""
+        return self.encode(b"\x00" * (Encoder.FRAME_SIZE - len(self.pending)))
+
+
+# SinkSettings upstream names
+upstreams = {
+    "linear16": PCMUpstream,
+    "mono16k": MonoUpstream,
+    "opus": OpusUpstream,
+}
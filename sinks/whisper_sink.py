@@ -1,66 +1,51 @@
 # Default libraries
 import threading
-from queue import Queue
-from tempfile import NamedTemporaryFile
-import io
-import time
 import re
-import wave
 import asyncio
 
 # 3rd party libraries
 from discord.sinks.core import Filters, Sink, default_filters
-import torch  # Had issues where removing torch causes whisper to throw an error
-from faster_whisper import WhisperModel  # TODO Perhaps have option for default whisper
-import speech_recognition as sr  # TODO Replace with something simpler
-
-# Outside of class so it doesn't load everytime the bot joins a discord call
-# Models are: "base.en" "small.en" "medium.en" "large-v2"
-# distil-large-v3 turbo
-audio_model = WhisperModel("distil-large-v3", device="cuda", compute_type="float16")
-
-excluded_phrases = [
-    "",
-    "thanks",
-    "tch",
-    "thank you so much thank you",
-    "for more information on covid-19 vaccines visit our website" "thank you very much",
-    "thank you very much.",
-    "we'll be right back.",
-    "subs by www.zeoranger.co.uk",
-    "hello everyone",
-    "thank you bye",
-    "thank you",
-    "all right",
-    "thank you thank you",
-    "thank you for watching",
-    "thanks for watching",
-    "i'll see you next time",
-    "got to cancel",
-    "shh",
-    "wow",
-    "shhh",
-    "hello",
-    "you",
-    "the",
-    "yeah",
-    "but",
-    "heh heh",
-    "heh",
-    "bye",
-    "okay",
-    "silence",
-]
+import numpy as np
+
+from sinks.asr_backends import FasterWhisperBackend, shared_backend
+from sinks.audio import WHISPER_SAMPLE_RATE, PCMBuffer, Resampler, rms, trim_silence
+from sinks.clock import SystemClock
+from sinks.events import UtteranceEvents
+from sinks.ingest import DROP_SILENCE, IngestQueue
+from sinks.latency import LatencyTracker
+from sinks.memory import process_memory_budget
+from sinks.streaming import LocalAgreement, words_to_text
+from sinks.suppression import HallucinationFilter
+
+# Seconds of audio each speaker's buffer is preallocated for, it grows if someone talks for longer
+buffer_seconds = 10
+
+# Silence kept around speech when a buffer is trimmed before decoding, so word edges aren't cut
+silence_padding = WHISPER_SAMPLE_RATE // 5
+
+# How much of the committed text is given to whisper as the prompt for the next decode
+prompt_chars = 200
 
 
 # Class for storing info for each speaker in discord
 class Speaker:
-    def __init__(self, user, data):
+    def __init__(self, user, data, buffer_size, arrival, current_time):
         self.user = user
 
-        self.data = [data]
+        # 16 kHz mono audio, converted from discord's format as it arrived in write()
+        self.data = PCMBuffer(buffer_size)
+        self.new_samples = self.data.append(data)
+
+        self.last_decode = 0
 
-        current_time = time.time()
+        # When the audio waiting to be transcribed started waiting, and how long the last decode had to wait
+        self.pending_since = current_time
+        self.queue_wait = 0.0
+
+        self.new_utterance(current_time, arrival)
+
+    # Resets the text, for a speaker who keeps talking after their phrase was sent out early
+    def new_utterance(self, current_time, arrival):
         self.last_word = current_time
         self.last_phrase = current_time
 
@@ -69,20 +54,30 @@ class Speaker:
         self.phrase = ""
         self.textBuffer = ""
 
-        self.empty_bytes_counter = 0
-        self.new_bytes = 1
-
         self.preflag = False
 
+        self.agreement = LocalAgreement()
+
+        # When this utterance went through each stage in sinks.latency.STAGES, sent out with the finish event
+        self.timestamps = {"packet": arrival}
+
+        self.events = UtteranceEvents(self.user)
+
 
 class WhisperSink(Sink):
     """A sink for discord that takes audio in a voice channel and transcribes it for each user.\n
 
-    Uses faster whisper for transcription. can be swapped out for other audio transcription libraries pretty easily.\n
+    Uses faster whisper for transcription by default, any ASRBackend from sinks.asr_backends can be passed in instead.\n
+    Finish events carry the utterance's "timestamps", and latency holds the sink's per stage latency histograms.\n
+    All timing goes through clock, pass a sinks.clock.VirtualClock to simulate the timeouts faster than real time.\n
+    To use several cores or GPUs, pass a TranscriptionPool from sinks.worker_pool as the backend.\n
 
     Inputs:\n
-    queue - Used for sending the transcription output to a callback function\n
+    queue - Used for sending the transcription output to a callback function, as sinks.events.TranscriptionEvent objects\n
+    backend - The ASRBackend used for transcription\n
+    suppression - The HallucinationFilter used to drop likely hallucinations, see sinks.suppression\n
     filters - Some discord thing I'm not sure about\n
+    clock - Where the sink gets the time from, the real clock by default\n
     data_length - The amount of data to save when user is silent but their mic is still active\n
     quiet_phrase_timeout - A larger timeout for when the transcription has detected the user is in mid sentence\n
     mid_sentence_multiplier - A smaller timout when the transcription has detected the user has finished a sentence\n
@@ -90,6 +85,16 @@ class WhisperSink(Sink):
     max_phrase_timeout - Send out the current transcription after x seconds if the user continues to talk for a long period\n
     min_phrase_length - Minimum length of transcription to reduce noise\n
     max_speakers - The amount of users to transcribe when all speakers are talking at once.\n
+    decode_interval - Minimum time between transcriptions of the same speaker while they keep talking\n
+    max_batch_size - The most speakers transcribed in one model call, the ones closest to being sent out go first. -1 for no limit\n
+    max_queue_wait - Speakers whose audio has waited longer than this are transcribed first, regardless of their deadline\n
+    vad_threshold - Packets quieter than this RMS level (0 to 1) are dropped as silence before they are queued\n
+    vad_hangover - Seconds of silence still kept after someone speaks, so the end of their words isn't lost\n
+    ingest_policy - What happens to a speaker's audio that the voice thread can't keep up with, see sinks.ingest\n
+    max_ingest_seconds - The most audio per speaker waiting for the voice thread before the ingest policy kicks in\n
+    max_speaker_bytes - Memory one speaker's buffer may use. Past it their phrase is sent out early and the buffer shrunk. 0 for no limit\n
+    max_sink_bytes - Memory all speakers of this sink may use together, the biggest buffers are sent out early first. 0 for no limit\n
+    memory_budget - sinks.memory.MemoryBudget shared with other sinks, by default one for the whole process\n
     """
 
     def __init__(
@@ -97,18 +102,35 @@ class WhisperSink(Sink):
         queue: asyncio.Queue,
         loop: asyncio.BaseEventLoop,
         *,
+        backend=None,
+        suppression=None,
         filters=None,
+        clock=None,
         data_length=50000,
         quiet_phrase_timeout=1.2,
         mid_sentence_multiplier=1.8,
         no_data_multiplier=0.75,
         max_phrase_timeout=30,
         min_phrase_length=3,
-        max_speakers=-1
+        max_speakers=-1,
+        decode_interval=0.45,
+        max_batch_size=-1,
+        max_queue_wait=2.0,
+        vad_threshold=0.01,
+        vad_hangover=0.3,
+        ingest_policy=DROP_SILENCE,
+        max_ingest_seconds=10,
+        max_speaker_bytes=4 * 1024 * 1024,
+        max_sink_bytes=32 * 1024 * 1024,
+        memory_budget=None,
     ):
         self.queue = queue
         self.loop = loop
 
+        self.backend = backend if backend is not None else self.default_backend()
+        self.suppression = suppression if suppression is not None else HallucinationFilter()
+        self.clock = clock if clock is not None else SystemClock()
+
         if filters is None:
             filters = default_filters
         self.filters = filters
@@ -121,85 +143,122 @@ class WhisperSink(Sink):
         self.max_phrase_timeout = max_phrase_timeout
         self.min_phrase_length = min_phrase_length
         self.max_speakers = max_speakers
+        self.decode_interval = decode_interval
+        self.max_batch_size = max_batch_size
+        self.max_queue_wait = max_queue_wait
+        self.vad_threshold = vad_threshold
+        self.vad_hangover = vad_hangover
+        self.max_speaker_bytes = max_speaker_bytes
+        self.max_sink_bytes = max_sink_bytes
+        self.memory_budget = (
+            memory_budget if memory_budget is not None else process_memory_budget
+        )
+
+        # Samples each speaker's buffer starts with and is shrunk back to, well under max_speaker_bytes
+        self.buffer_size = buffer_seconds * WHISPER_SAMPLE_RATE
+        if max_speaker_bytes > 0:
+            self.buffer_size = min(self.buffer_size, max_speaker_bytes // 8)
+
+        # Only used by write() on discord's decoder thread.
+        # Time of each user's last packet with speech, and their last silent packet to put in front of the next speech.
+        self.last_voice = {}
+        self.vad_preroll = {}
+        # Each user's audio is resampled as one stream, so the filter carries over from packet to packet
+        self.resamplers = {}
 
         self.vc = None
         self.audio_data = {}
 
         self.running = True
 
-        self.speakers = []
+        self.latency = LatencyTracker()
 
-        self.temp_file = NamedTemporaryFile().name
+        # Speakers keyed by user id, dicts keep insertion order so speakers are still handled in join order
+        self.speakers = {}
 
-        self.voice_queue = Queue()
+        # write() puts audio in voice_queue and notifies voice_event to wake the voice thread.
+        # voice_queue is bounded per speaker, so a voice thread that falls behind loses audio instead of memory.
+        self.voice_queue = IngestQueue(
+            max_packets=max_ingest_seconds * 50,
+            max_length=max_ingest_seconds * WHISPER_SAMPLE_RATE,
+            policy=ingest_policy,
+            join=np.concatenate,
+        )
+        self.voice_event = threading.Condition()
         self.voice_thread = threading.Thread(target=self.insert_voice, args=())
         self.voice_thread.start()
 
     def is_valid_phrase(self, speaker_phrase, result):
-        cleaned_result = re.sub(r"[.!?,]", "", result).lower().strip()
-        return speaker_phrase != result and cleaned_result not in excluded_phrases
-
-    def transcribe_audio(self):
-        # The whisper model
-        segments, info = audio_model.transcribe(
-            self.temp_file,
-            beam_size=10,
-            best_of=3,
-            vad_filter=True,
-            vad_parameters=dict(min_silence_duration_ms=250 ),
-            no_speech_threshold = 0.6,
-
-        )
-        segments = list(segments) 
-        ret = {}
-        ret["text"] = ""
-        for seg in segments[:-2]:
-            ret["text"] += seg.text
-
-        ret["partial"] = ""
-        for seg in segments[-2:]:
-            ret["partial"] += seg.text
-
-        if len(segments) > 2:
-            ret["cutoff"] = segments[-3].end
-        else:
-            ret["cutoff"] = 0
-        return ret
-
-      # Get SST from whisper and store result into speaker
-    def transcribe(self, speaker: Speaker):
-        # TODO Figure out the best way to save the audio fast and remove any noise
-        sampling_rate = self.vc.decoder.SAMPLING_RATE
-        sample_size = self.vc.decoder.SAMPLE_SIZE // self.vc.decoder.CHANNELS
-        channels = self.vc.decoder.CHANNELS
-
-        audio_data = sr.AudioData(
-            bytes().join(speaker.data),
-            sampling_rate,
-            sample_size,
+        return speaker_phrase != result and not self.suppression.is_excluded(result)
+
+    # Backend used when none is passed in.
+    # It's shared by every sink so it doesn't load everytime the bot joins a discord call, and only loads when first used.
+    # Models are: "base.en" "small.en" "medium.en" "large-v2"
+    # distil-large-v3 turbo
+    # One worker, every extra one is another copy of the model in VRAM
+    @classmethod
+    def default_backend(cls):
+        return shared_backend(
+            FasterWhisperBackend, "distil-large-v3", device="cuda", compute_type="float16", workers=1
         )
-        wav_data = io.BytesIO(audio_data.get_wav_data())
 
-        with open(self.temp_file, "wb") as file:
-            wave_writer = wave.open(file, "wb")
-            wave_writer.setnchannels(channels)
-            wave_writer.setsampwidth(sample_size)
-            wave_writer.setframerate(sampling_rate)
-            wave_writer.writeframes(wav_data.getvalue())
-            wave_writer.close()
-
-        # Transcribe results takes wav file (self.temp_file) and outputs transcription
-        textData = self.transcribe_audio()
-        transcription = textData["text"]
-        newText = textData["partial"]
+    def transcribe_audio(self, audios, prompts, keys=None):
+        results = self.backend.transcribe_batch(audios, prompts, keys)
+        # Hallucinated segments are dropped here so they never reach the phrase or the LLM
+        return [
+            [word for segment in self.suppression.filter(segments) for word in segment.words]
+            for segments in results
+        ]
+
+    # Get SST from whisper for every speaker with new audio in one batch
+    def transcribe(self, speakers):
+        # Buffers are already 16 kHz mono float32, so whisper gets a view of each one without any copy.
+        # Leading silence is dropped for good, trailing silence is only left out of this decode.
+        audible = []
+        audios = []
+        for speaker in speakers:
+            start, end = trim_silence(
+                speaker.data.view(), self.vad_threshold, silence_padding
+            )
+            speaker.data.consume(start)
+            if end > start:
+                audible.append(speaker)
+                audios.append(speaker.data.view()[: end - start])
+            else:
+                # Nothing but silence, no reason to run the model
+                self.update_speaker(speaker, [])
+
+        if not audible:
+            return
+
+        # The committed text is the context for the audio that is left
+        prompts = [speaker.textBuffer[-prompt_chars:] for speaker in audible]
+
+        # Transcribe results takes every speaker's audio at once and outputs the words for each
+        decode_start = self.clock.time()
+        results = self.transcribe_audio(
+            audios, prompts, [speaker.user for speaker in audible]
+        )
+        decode_end = self.clock.time()
+        for speaker, audio, words in zip(audible, audios, results):
+            speaker.timestamps["decode_start"] = decode_start
+            speaker.timestamps["decode_end"] = decode_end
+            # A prefinish from before this decode is stale, it's recorded again if this phrase sends a new one
+            speaker.timestamps.pop("prefinish", None)
+            self.update_speaker(speaker, words, len(audio))
+
+    # Store a transcription result into its speaker, decoded_samples is how much of the buffer the words were transcribed from
+    def update_speaker(self, speaker: Speaker, words, decoded_samples=0):
+        hypothesis = words_to_text(words)
 
         # Checks if user is saying a new valid phrase
-        if self.is_valid_phrase(speaker.phrase, newText):
-            speaker.empty_bytes_counter = 0
+        if self.is_valid_phrase(speaker.phrase, hypothesis):
+            # Words that agree with the last decode are committed, the rest may still change
+            committed = speaker.agreement.insert(words)
+            speaker.textBuffer += words_to_text(committed)
 
             speaker.word_timeout = self.quiet_phrase_timeout
-            speaker.textBuffer += transcription
-            speaker.phrase = speaker.textBuffer + newText
+            speaker.phrase = speaker.textBuffer + words_to_text(speaker.agreement.pending)
 
             # Detect if user is mid sentence and delay sending full message
             if re.search(r"\s*\.{2,}$", speaker.phrase) or not re.search(
@@ -209,119 +268,244 @@ class WhisperSink(Sink):
                     speaker.word_timeout * self.mid_sentence_multiplier
                 )
 
-            # find cutoff point to process less audio next time, text gets concotinated
-            raw_bytes = bytes().join(speaker.data)
-            lenB4 = len(raw_bytes)
-            raw_bytes = self.cutoffData(
-                raw_bytes, sampling_rate, sample_size, channels, textData["cutoff"]
-            )
-            lenAfter = len(raw_bytes)
-            if lenB4 != lenAfter:
-                print(f"Cut off {lenB4-lenAfter} bytes, {lenAfter} bytes remaining")
-            speaker.data = [raw_bytes]
-
-            speaker.last_word = time.time()
+            # Committed audio is dropped, so the next decode only covers what hasn't been agreed on yet
+            if committed:
+                cutoff_samples = self.cutoffData(committed[-1].end, decoded_samples)
+                speaker.data.consume(cutoff_samples)
+                print(
+                    f"Cut off {cutoff_samples} samples, {len(speaker.data)} samples remaining"
+                )
 
-        # If user's mic is on but not saying anything, remove those bytes for faster inference.
-        elif speaker.empty_bytes_counter > 5:
-            speaker.data = speaker.data[: -speaker.new_bytes]
-        else:
-            speaker.empty_bytes_counter += 1
+            speaker.last_word = self.clock.time()
+
+    # Converts whisper's cutoff time into the number of samples to drop from the front of the buffer.
+    # Buffers are mono, so every sample is a whole frame and any count keeps the audio after it aligned.
+    # Rounded rather than truncated, 0.3 s is 4799.99 samples in floating point.
+    # Never past the audio that was decoded, anything after it arrived later and isn't covered by the timestamps.
+    def cutoffData(self, cutoff_seconds, decoded_samples):
+        cutoff_samples = round(WHISPER_SAMPLE_RATE * cutoff_seconds)
+        return min(max(cutoff_samples, 0), decoded_samples)
+
+    # When the speaker's phrase gets sent out (or the speaker dropped) if nothing new is heard from them
+    def finalize_deadline(self, speaker):
+        if len(speaker.phrase) < self.min_phrase_length:
+            return speaker.last_word + self.quiet_phrase_timeout * 2
+
+        word_timeout = speaker.word_timeout
+        if speaker.new_samples == 0:
+            word_timeout = word_timeout * self.no_data_multiplier
+        return min(
+            speaker.last_word + word_timeout,
+            speaker.last_phrase + self.max_phrase_timeout,
+        )
 
-    def cutoffData(
-        self, raw_bytes, sampling_rate, sample_size, channels, cutoff_seconds
-    ):
-        byte_rate = sampling_rate * sample_size * channels
-        cutoff_bytes = byte_rate * cutoff_seconds
-        return raw_bytes[int(cutoff_bytes) :]
+    # Earliest time the voice thread has to wake up on its own, None means nothing is due until discord sends audio.
+    # insert_voice() acts once the time reaches one of these, computed the same way, or it would wake up and do nothing until the next one
+    def next_deadline(self):
+        deadlines = []
+        for speaker in self.speakers.values():
+            if speaker.new_samples > 0:
+                deadlines.append(speaker.last_decode + self.decode_interval)
+            if len(speaker.phrase) >= self.min_phrase_length and not speaker.preflag:
+                deadlines.append(speaker.last_word + 0.25)
+            deadlines.append(self.finalize_deadline(speaker))
+        return min(deadlines, default=None)
+
+    # Picks who gets transcribed this time, earliest finalize deadline first.
+    # Anyone who has waited longer than max_queue_wait goes first so nobody starves.
+    def schedule(self, current_time):
+        ready = [
+            speaker
+            for speaker in self.speakers.values()
+            if speaker.new_samples > 0
+            and current_time - speaker.last_decode >= self.decode_interval
+        ]
+        ready.sort(
+            key=lambda speaker: (
+                current_time - speaker.pending_since <= self.max_queue_wait,
+                self.finalize_deadline(speaker),
+            )
+        )
+        if self.max_batch_size > 0:
+            ready = ready[: self.max_batch_size]
+        return ready
+
+    # Sleeps until write() hands over audio or the next speaker deadline passes, an idle sink uses no CPU
+    def wait_for_voice(self):
+        with self.voice_event:
+            deadline = self.next_deadline()
+            while self.running and not self.voice_queue:
+                if deadline is None:
+                    self.clock.wait(self.voice_event)
+                else:
+                    timeout = deadline - self.clock.time()
+                    if timeout <= 0:
+                        break
+                    self.clock.wait(self.voice_event, timeout)
+
+            return self.voice_queue.drain()
 
     def insert_voice(self):
+        # Load the model on the voice thread when the bot joins, audio from discord waits in voice_queue meanwhile
+        try:
+            self.backend.warmup()
+        except Exception as e:
+            print("Error warming up", e)
+
         while self.running:
             try:
-                if not self.voice_queue.empty():
-                    # Sorts data from queue for each speaker after each transcription
-                    while not self.voice_queue.empty():
-                        item = self.voice_queue.get()
-
-                        user_heard = False
-                        for speaker in self.speakers:
-                            if item[0] == speaker.user:
-                                speaker.data.append(item[1])
-                                user_heard = True
-                                speaker.new_bytes += 1
-                                break
-
-                        if not user_heard:
-                            if (
-                                self.max_speakers < 0
-                                or len(self.speakers) <= self.max_speakers
-                            ):
-                                self.speakers.append(Speaker(item[0], item[1]))
-
-                # STT for each speaker currently talking on discord
-                for speaker in self.speakers:
-                    # No reason to transcribe if no new data has come from discord.
-                    if speaker.new_bytes > 0:
-                        self.transcribe(speaker)
-                        speaker.new_bytes = 0
+                items = self.wait_for_voice()
+
+                # Sorts data from queue for each speaker after each transcription
+                for user, data, arrival in items:
+                    speaker = self.speakers.get(user)
+                    if speaker is not None:
+                        if speaker.new_samples == 0:
+                            speaker.pending_since = self.clock.time()
+                        speaker.new_samples += speaker.data.append(data)
+                    elif (
+                        self.max_speakers < 0
+                        or len(self.speakers) < self.max_speakers
+                    ):
+                        self.speakers[user] = Speaker(
+                            user,
+                            data,
+                            self.buffer_size,
+                            arrival,
+                            self.clock.time(),
+                        )
+
+                # STT for every speaker currently talking on discord, batched into one model call.
+                # No reason to transcribe if no new data has come from discord.
+                current_time = self.clock.time()
+                decoded = self.schedule(current_time)
+                if decoded:
+                    for speaker in decoded:
+                        speaker.queue_wait = current_time - speaker.pending_since
+                    # Marked as decoded even if the backend raised, so a failing model is retried
+                    # after decode_interval instead of in a busy loop
+                    try:
+                        self.transcribe(decoded)
+                    finally:
+                        for speaker in decoded:
+                            speaker.new_samples = 0
+                            speaker.last_decode = current_time
+                            speaker.preflag = False
+
+                # Iterate over a copy so finished speakers can be removed safely
+                for speaker in list(self.speakers.values()):
+                    if speaker in decoded or speaker.new_samples > 0:
                         word_timeout = speaker.word_timeout
-                        speaker.preflag = False
                     else:
                         # No data coming in from discord, reduces word_timeout for faster inference
                         word_timeout = speaker.word_timeout * self.no_data_multiplier
 
-                    current_time = time.time()
+                    current_time = self.clock.time()
 
                     if len(speaker.phrase) >= self.min_phrase_length:
-                        # print(f"{time.time()} {word_timeout}")
+                        # print(f"{current_time} {word_timeout}")
                         if (
-                            current_time - speaker.last_word > 0.25
+                            current_time >= speaker.last_word + 0.25
                             and not speaker.preflag
                         ):
-                            self.queueUp(
-                                {
-                                    "type": "prefinish",
-                                    "user": speaker.user,
-                                    "result": speaker.phrase,
-                                }
-                            )
+                            event = speaker.events.prefinish(speaker.phrase)
+                            if event is not None:
+                                speaker.timestamps["prefinish"] = current_time
+                                self.queueUp(event)
                             speaker.preflag = True
                         # If the user stops saying anything new or has been speaking too long.
                         elif (
-                            current_time - speaker.last_word > word_timeout
-                            or current_time - speaker.last_phrase
-                            > self.max_phrase_timeout
+                            current_time >= speaker.last_word + word_timeout
+                            or current_time
+                            >= speaker.last_phrase + self.max_phrase_timeout
                         ):
-                            self.queueUp(
-                                {
-                                    "type": "finish",
-                                    "user": speaker.user,
-                                    "result": speaker.phrase,
-                                }
-                            )
-                            self.speakers.remove(speaker)
-                        else:
-                            # report progress, may have to check if string has actually changed here
-                            self.queueUp(
-                                {
-                                    "type": "progress",
-                                    "user": speaker.user,
-                                    "result": speaker.phrase,
-                                }
-                            )
-                    elif current_time > self.quiet_phrase_timeout * 2:
+                            self.finish(speaker, current_time)
+                            self.remove_speaker(speaker)
+                        elif speaker in decoded:
+                            # Report progress, only if the phrase actually changed
+                            event = speaker.events.progress(speaker.phrase)
+                            if event is not None:
+                                self.queueUp(event)
+                    elif current_time >= speaker.last_word + self.quiet_phrase_timeout * 2:
                         # Reset Remove the speaker if no valid phrase detected after set period of time
-                        self.speakers.remove(speaker)
+                        self.remove_speaker(speaker)
+
+                self.enforce_memory_budgets()
 
             except Exception as e:
                 print("Error in loop", e)
-            # Loops with no wait time is bad
-            time.sleep(0.45)
-
 
-    def queueUp(self, data):
-        # print(f"queue: {data['type']}")
-        self.loop.call_soon_threadsafe(self.queue.put_nowait, data)
+        self.memory_budget.release(self)
+
+    def finish(self, speaker: Speaker, current_time):
+        speaker.timestamps["finish"] = current_time
+        self.latency.record(speaker.timestamps)
+        self.queueUp(speaker.events.finish(speaker.phrase, dict(speaker.timestamps)))
+
+    def remove_speaker(self, speaker: Speaker):
+        del self.speakers[speaker.user]
+        self.backend.release(speaker.user)
+
+    # Sends out what a speaker has said so far and shrinks their buffer, for when they use too much memory.
+    # They keep talking into a new utterance, only the audio that hasn't been transcribed yet is kept.
+    def force_finalize(self, speaker: Speaker):
+        current_time = self.clock.time()
+        print(f"Memory budget exceeded, finalizing {speaker.user} early")
+        if len(speaker.phrase) >= self.min_phrase_length:
+            self.finish(speaker, current_time)
+
+        # Everything that was transcribed is in the phrase that was just sent
+        speaker.data.consume(len(speaker.data) - speaker.new_samples)
+        speaker.data.compact(self.buffer_size)
+        speaker.new_utterance(current_time, current_time)
+
+    def buffered_bytes(self):
+        return sum(speaker.data.nbytes for speaker in list(self.speakers.values()))
+
+    def enforce_memory_budgets(self):
+        if self.max_speaker_bytes > 0:
+            for speaker in self.speakers.values():
+                if speaker.data.nbytes > self.max_speaker_bytes:
+                    self.force_finalize(speaker)
+
+        # Biggest buffers go first, until this sink and every sink sharing the budget fit again.
+        # Buffers that never grew can't be shrunk, so they are left alone.
+        for speaker in sorted(
+            self.speakers.values(), key=lambda speaker: speaker.data.nbytes, reverse=True
+        ):
+            total = self.buffered_bytes()
+            self.memory_budget.update(self, total)
+            if (
+                self.max_sink_bytes <= 0 or total <= self.max_sink_bytes
+            ) and not self.memory_budget.exceeded():
+                break
+            if speaker.data.nbytes <= self.buffer_size * 4:
+                break
+            self.force_finalize(speaker)
+        self.memory_budget.update(self, self.buffered_bytes())
+
+    # Numbers for each speaker, for monitoring. Safe to call from any thread.
+    # queue_wait is how long their last transcription waited, pending_wait how long their current audio has been waiting.
+    # dropped is how many of their packets the ingest policy has thrown away, buffered_bytes the memory their audio buffer uses.
+    def stats(self):
+        current_time = self.clock.time()
+        return {
+            speaker.user: {
+                "queue_wait": speaker.queue_wait,
+                "pending_wait": (
+                    current_time - speaker.pending_since
+                    if speaker.new_samples > 0
+                    else 0.0
+                ),
+                "dropped": self.voice_queue.dropped(speaker.user),
+                "buffered_bytes": speaker.data.nbytes,
+            }
+            for speaker in list(self.speakers.values())
+        }
+
+    def queueUp(self, event):
+        # print(f"queue: {event.type}")
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
 
     # Gets audio data from discord for each user talking
     @Filters.container
@@ -333,12 +517,38 @@ class WhisperSink(Sink):
             if data_len > self.data_length:
                 data = data[-self.data_length :]
 
+            # Downmix and resample to 16 kHz mono once, here, instead of on every decode
+            resampler = self.resamplers.get(user)
+            if resampler is None:
+                resampler = Resampler(
+                    self.vc.decoder.SAMPLING_RATE, self.vc.decoder.CHANNELS
+                )
+                self.resamplers[user] = resampler
+            data = resampler.process(data)
+
+            # Energy gate, silent packets never reach the voice thread or the model.
+            # An open mic that only picks up silence costs nothing.
+            current_time = self.clock.time()
+            silent = rms(data) < self.vad_threshold
+            if not silent:
+                self.last_voice[user] = current_time
+                preroll = self.vad_preroll.pop(user, None)
+                if preroll is not None:
+                    data = np.concatenate((preroll, data))
+            elif current_time - self.last_voice.get(user, 0) > self.vad_hangover:
+                self.vad_preroll[user] = data
+                return
+
             # Send bytes to be transcribed
-            self.voice_queue.put([user, data])
+            with self.voice_event:
+                self.voice_queue.put(user, data, silent, current_time)
+                self.voice_event.notify()
         except Exception as e:
             print("Error in loop", e)
 
     # End thread
     def close(self):
         self.running = False
+        with self.voice_event:
+            self.voice_event.notify()
         self.queue.put_nowait(None)
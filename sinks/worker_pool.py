@@ -0,0 +1,127 @@
+# Default libraries
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sinks.asr_backends import ASRBackend
+
+# The backend of a process worker, created by init_process_worker inside that process
+process_backend = None
+
+
+def init_process_worker(backend_factory):
+    global process_backend
+    process_backend = backend_factory()
+
+
+def run_process_worker(method, *args):
+    return getattr(process_backend, method)(*args)
+
+
+# Runs backend calls on its own thread, the backend is created on that thread the first time it is used
+class ThreadWorker:
+    def __init__(self, backend_factory):
+        self.backend_factory = backend_factory
+        self.backend = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def run(self, method, *args):
+        if self.backend is None:
+            self.backend = self.backend_factory()
+        return getattr(self.backend, method)(*args)
+
+    def submit(self, method, *args):
+        return self.executor.submit(self.run, method, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+# Runs backend calls in its own process, for CPU backends that hold the GIL
+class ProcessWorker:
+    def __init__(self, backend_factory):
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            initializer=init_process_worker,
+            initargs=(backend_factory,),
+        )
+
+    def submit(self, method, *args):
+        return self.executor.submit(run_process_worker, method, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class TranscriptionPool(ASRBackend):
+    """Spreads transcription over several inference workers, each with its own backend.\n
+
+    Every speaker is pinned to one worker (the least busy one when they start talking), so their audio and prompts always go to the same model.\n
+    A batch is split by worker, every worker decodes its part at the same time, and the results come back in the original order.\n
+
+    Inputs:\n
+    backend_factory - Called once per worker to create its ASRBackend. Process workers need it to be picklable, like functools.partial(FasterWhisperBackend, "small.en")\n
+    workers - Number of workers\n
+    mode - "thread" for backends that release the GIL (CTranslate2, torch on a GPU), "process" for CPU backends that don't\n
+    """
+
+    def __init__(self, backend_factory, *, workers=2, mode="thread"):
+        super().__init__()
+        if mode == "thread":
+            worker_class = ThreadWorker
+        elif mode == "process":
+            worker_class = ProcessWorker
+        else:
+            raise ValueError(f"Unknown worker mode: {mode}")
+
+        self.workers = [worker_class(backend_factory) for _ in range(workers)]
+
+        # Which worker each speaker is pinned to
+        self.affinity = {}
+        self.affinity_lock = threading.Lock()
+
+    def worker_for(self, key):
+        with self.affinity_lock:
+            if key not in self.affinity:
+                load = [0] * len(self.workers)
+                for worker in self.affinity.values():
+                    load[worker] += 1
+                self.affinity[key] = load.index(min(load))
+            return self.affinity[key]
+
+    # Unpins a speaker once the sink is done with them
+    def release(self, key):
+        with self.affinity_lock:
+            self.affinity.pop(key, None)
+
+    def warmup(self):
+        futures = [worker.submit("warmup") for worker in self.workers]
+        for future in futures:
+            future.result()
+
+    def transcribe_batch(self, audios, prompts, keys=None):
+        groups = {}
+        for index in range(len(audios)):
+            if keys is None:
+                worker = index % len(self.workers)
+            else:
+                worker = self.worker_for(keys[index])
+            groups.setdefault(worker, []).append(index)
+
+        futures = {
+            worker: self.workers[worker].submit(
+                "transcribe_batch",
+                [audios[index] for index in indexes],
+                [prompts[index] for index in indexes],
+            )
+            for worker, indexes in groups.items()
+        }
+
+        results = [None] * len(audios)
+        for worker, indexes in groups.items():
+            for index, segments in zip(indexes, futures[worker].result()):
+                results[index] = segments
+        return results
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
@@ -0,0 +1,85 @@
+# Default libraries
+import asyncio
+import time
+
+# 3rd party libraries
+import numpy as np
+import pytest
+
+from sinks.asr_backends import FakeBackend
+from sinks.audio import Resampler
+from sinks.clock import VirtualClock
+from sinks.whisper_sink import WhisperSink
+from utils.replay_capture import ReplayVoiceClient
+
+USER = 42
+
+
+# 20 ms of loud 48 kHz stereo, every packet different so the buffer contents can be checked
+def packet(index):
+    samples = 2000 + (np.arange(960, dtype=np.int32) + index * 960) % 1000 * 10
+    return np.repeat(samples, 2).astype(np.int16).tobytes()
+
+
+# A WhisperSink with a FakeBackend, both on a VirtualClock
+class Harness:
+    def __init__(self, script, **backend_options):
+        self.loop = asyncio.new_event_loop()
+        self.clock = VirtualClock(1000.0)
+        self.backend = FakeBackend(script, clock=self.clock, **backend_options)
+        self.sink = WhisperSink(
+            asyncio.Queue(),
+            self.loop,
+            backend=self.backend,
+            clock=self.clock,
+            decode_interval=0.1,
+            quiet_phrase_timeout=10,
+        )
+        self.sink.init(ReplayVoiceClient(48000, 2))
+        # Resamples the packets the same way the sink does, for checking what is in its buffers
+        self.resampler = Resampler(48000, 2)
+        self.audio = []
+        self.packets = 0
+
+        # Wait for the voice thread to start waiting on the clock
+        deadline = time.time() + 5
+        while self.sink.voice_thread not in self.clock.threads:
+            assert time.time() < deadline
+            time.sleep(0.001)
+
+    # The voice thread can't take packets while voice_event is held, so it gets all of them at once
+    def write(self, count):
+        with self.sink.voice_event:
+            for _ in range(count):
+                data = packet(self.packets)
+                self.packets += 1
+                self.audio.append(self.resampler.process(data))
+                self.sink.write(data, USER)
+        self.clock.advance(0)
+        assert self.clock.wait_idle()
+
+    def step(self, seconds):
+        self.clock.advance(seconds)
+        assert self.clock.wait_idle()
+
+    def speaker(self):
+        return self.sink.speakers[USER]
+
+    def close(self):
+        self.sink.close()
+        self.clock.advance(0)
+        self.sink.voice_thread.join(5)
+        self.loop.close()
+
+
+@pytest.fixture
+def harness():
+    harnesses = []
+
+    def make(script, **backend_options):
+        harnesses.append(Harness(script, **backend_options))
+        return harnesses[-1]
+
+    yield make
+    for made in harnesses:
+        made.close()
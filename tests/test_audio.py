@@ -0,0 +1,31 @@
+# 3rd party libraries
+import numpy as np
+
+from sinks.audio import Resampler, resample
+
+
+def tone(frequency, seconds=1.0, rate=48000):
+    return np.sin(2 * np.pi * frequency * np.arange(int(rate * seconds)) / rate).astype(np.float32)
+
+
+def level(audio):
+    return np.sqrt(np.mean(np.square(audio[200:-200])))
+
+
+def test_resample_keeps_speech_and_stops_aliasing():
+    assert level(resample(tone(1000), 48000)) > 0.7 * level(tone(1000))
+    # 12 kHz would fold back to 4 kHz at 16 kHz
+    assert level(resample(tone(12000), 48000)) < 0.001
+
+
+def test_resampler_matches_one_shot_resample_across_packets():
+    stereo = np.repeat((tone(440) * 10000).astype(np.int16), 2)
+    pcm = stereo.tobytes()
+
+    resampler = Resampler(48000, 2)
+    # Packets that aren't a multiple of the factor, so the decimation has to keep its place
+    streamed = np.concatenate([resampler.process(pcm[i : i + 1000]) for i in range(0, len(pcm), 1000)])
+
+    mono = stereo.reshape(-1, 2).mean(axis=1, dtype=np.float32) / 32768.0
+    whole = resample(mono, 48000)
+    np.testing.assert_allclose(streamed[100:15000], whole[100:15000], atol=1e-6)
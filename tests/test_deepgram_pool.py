@@ -0,0 +1,160 @@
+# Default libraries
+import asyncio
+
+# 3rd party libraries
+import pytest
+
+deepgram = pytest.importorskip("deepgram")
+
+from sinks.clock import VirtualClock
+from sinks.deepgram_pool import DeepgramPool
+
+
+# Stands in for the SDK's async live connection, events are sent with emit()
+class FakeConnection:
+    def __init__(self):
+        self.handlers = {}
+        self.started = False
+        self.finished = False
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    async def emit(self, event, **kwargs):
+        for handler in self.handlers.get(event, []):
+            await handler(self, **kwargs)
+
+    async def start(self, options, addons=None):
+        self.started = True
+        return True
+
+    async def finish(self):
+        self.finished = True
+
+
+# Has the same listen.asyncwebsocket.v("1") a DeepgramClient has, and keeps every connection it made
+class FakeClient:
+    def __init__(self):
+        self.connections = []
+        self.listen = self
+        self.asyncwebsocket = self
+
+    def v(self, version):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+
+class Owner:
+    def __init__(self):
+        self.closed = 0
+
+    async def on_close(self, client, **kwargs):
+        self.closed += 1
+
+
+def make_pool(client, **options):
+    pool = DeepgramPool("key", {}, client=client, loop=asyncio.get_running_loop(), clock=VirtualClock(1000.0), **options)
+    pool.refill()
+    return pool
+
+
+# Lets the connections being opened in the background finish opening
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_released_connection_is_reused():
+    async def run():
+        client = FakeClient()
+        pool = make_pool(client, warm=1)
+        await settle()
+        assert len(pool.idle) == 1
+
+        first = await pool.acquire(Owner())
+        assert first.connection is client.connections[0]
+        await settle()
+        # Another one was opened for the next speaker
+        assert len(pool.idle) == 1
+
+        await pool.release(first)
+        second = await pool.acquire(Owner())
+        assert second is first
+        assert len(client.connections) == 2
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_acquire_waits_for_a_release_when_full():
+    async def run():
+        client = FakeClient()
+        pool = make_pool(client, warm=0, max_size=1)
+        first = await pool.acquire(Owner())
+
+        waiting = asyncio.ensure_future(pool.acquire(Owner()))
+        await settle()
+        assert not waiting.done()
+
+        await pool.release(first)
+        assert await waiting is first
+        assert len(client.connections) == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_idle_connections_past_warm_are_closed():
+    async def run():
+        client = FakeClient()
+        pool = make_pool(client, warm=1, idle_timeout=60)
+        await settle()
+        first = await pool.acquire(Owner())
+        second = await pool.acquire(Owner())
+        await pool.release(first)
+        await pool.release(second)
+        await settle()
+        idle = list(pool.idle)
+        assert len(idle) == 3
+
+        pool.clock.advance(30)
+        await pool.close_expired()
+        assert len(pool.idle) == 3
+
+        pool.clock.advance(31)
+        await pool.close_expired()
+        # The most recently used stays open as the warm one
+        assert pool.idle == idle[-1:]
+        assert all(pooled.connection.finished for pooled in idle[:-1])
+        assert pool.size() == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_closed_connection_is_replaced():
+    async def run():
+        client = FakeClient()
+        pool = make_pool(client, warm=1)
+        await settle()
+        idle = pool.idle[0]
+
+        # Deepgram closing an idle connection, the pool forgets it and opens another one
+        await idle.connection.emit(deepgram.LiveTranscriptionEvents.Close)
+        await settle()
+        assert idle.closed
+        assert idle not in pool.connections
+        assert pool.idle and pool.idle[0] is not idle
+
+        # Closing one that is checked out reaches its owner, and it isn't put back in the pool
+        owner = Owner()
+        pooled = await pool.acquire(owner)
+        await pooled.connection.emit(deepgram.LiveTranscriptionEvents.Close)
+        assert owner.closed == 1
+        await pool.release(pooled)
+        assert pooled not in pool.idle
+        assert pooled not in pool.connections
+        assert not pooled.connection.finished
+        await pool.close()
+
+    asyncio.run(run())
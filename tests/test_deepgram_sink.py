@@ -0,0 +1,39 @@
+# Default libraries
+import asyncio
+
+# 3rd party libraries
+import pytest
+
+pytest.importorskip("deepgram")
+
+from sinks.clock import VirtualClock
+from sinks.deepgram_sink import Speaker
+from sinks.events import FINISH, UtteranceEvents
+
+
+def test_utterance_without_finals_starts_the_next_one_over():
+    async def run():
+        queue = asyncio.Queue()
+        clock = VirtualClock(1000.0)
+        speaker = Speaker(asyncio.get_running_loop(), queue, None, clock=clock)
+        speaker.user = 42
+        speaker.events = UtteranceEvents(42)
+
+        # Noise, Deepgram never transcribed any of it
+        speaker.add_data(b"\x00" * 3840, clock.time(), clock.time())
+        speaker.finish_utterance()
+        assert queue.empty()
+
+        clock.advance(5)
+        speaker.add_data(b"\x00" * 3840, clock.time(), clock.time())
+        speaker.is_finals = ["hello there"]
+        clock.advance(1)
+        speaker.finish_utterance()
+
+        event = queue.get_nowait()
+        assert event.type == FINISH
+        assert event.sequence == 1
+        assert event.timestamps["packet"] == 1005.0
+        assert event.timestamps["finish"] == 1006.0
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+# 3rd party libraries
+import numpy as np
+
+from sinks.asr_backends import FakeBackend
+from sinks.clock import VirtualClock
+
+
+def test_decode_time_is_spent_on_the_clock():
+    clock = VirtualClock(0.0)
+    backend = FakeBackend(["hello"], delay=0.2, realtime_factor=0.5, clock=clock)
+
+    backend.transcribe_batch([np.zeros(16000, dtype=np.float32)], [""])
+
+    assert clock.time() == 0.7
+
+
+def test_saturated_backend_on_a_virtual_clock(harness):
+    # Decoding takes 2 s of virtual time, far longer than the 0.1 s decode_interval
+    run = harness(["hello there friend"], delay=2.0)
+
+    run.write(25)
+    assert run.backend.calls == 1
+    timestamps = run.speaker().timestamps
+    assert timestamps["decode_end"] - timestamps["decode_start"] == 2.0
+
+    assert run.clock.time() == 1002.0
+
+    # decode_interval passed while the backend was busy, so the next audio is decoded as soon as it arrives
+    run.write(5)
+    assert run.backend.calls == 2
+    assert run.clock.time() == 1004.0
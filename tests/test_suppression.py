@@ -0,0 +1,23 @@
+from sinks.streaming import Segment
+from sinks.suppression import HallucinationFilter
+
+
+def scored(avg_logprob=None, no_speech_prob=None):
+    return Segment(" turn the lights off please", 0.0, 1.5, [], avg_logprob, no_speech_prob)
+
+
+def test_confident_segment_whisper_kept_is_not_dropped():
+    assert not HallucinationFilter().is_hallucination(scored(avg_logprob=-0.3, no_speech_prob=0.9))
+
+
+def test_unconfident_silence_is_dropped():
+    assert HallucinationFilter().is_hallucination(scored(avg_logprob=-1.5, no_speech_prob=0.9))
+
+
+def test_unconfident_speech_is_kept():
+    assert not HallucinationFilter().is_hallucination(scored(avg_logprob=-1.5, no_speech_prob=0.1))
+
+
+def test_log_prob_alone_without_no_speech_prob():
+    assert HallucinationFilter().is_hallucination(scored(avg_logprob=-1.5))
+    assert not HallucinationFilter().is_hallucination(scored(avg_logprob=-0.3))
@@ -0,0 +1,63 @@
+# 3rd party libraries
+import numpy as np
+
+from sinks.streaming import Segment, Word
+
+
+def segment(*words):
+    return [Segment("".join(text for text, start, end in words), words[0][1], words[-1][2],
+                    [Word(text, start, end) for text, start, end in words])]
+
+
+def test_cutoff_rounds_to_nearest_sample(harness):
+    sink = harness([]).sink
+    assert sink.cutoffData(0.3, 10**6) == 4800
+    # 16000 * 2.01 is 32159.999... in floating point, truncating would lose a sample
+    assert sink.cutoffData(2.01, 10**6) == 32160
+
+
+def test_cutoff_clamped_to_decoded_samples(harness):
+    sink = harness([]).sink
+    assert sink.cutoffData(5.0, 8000) == 8000
+    assert sink.cutoffData(-0.1, 8000) == 0
+
+
+def test_committed_audio_is_consumed(harness):
+    run = harness([
+        segment((" hello", 0.0, 0.15), (" world", 0.15, 0.3)),
+        segment((" hello", 0.0, 0.15), (" world", 0.15, 0.3), (" again", 0.3, 0.45)),
+    ])
+
+    run.write(25)
+    run.step(0.2)
+    assert run.backend.calls == 1
+    assert len(run.speaker().data) == len(np.concatenate(run.audio))
+
+    run.write(5)
+    run.step(0.2)
+    assert run.backend.calls == 2
+
+    # hello and world agreed, 0.3 s of the front of the buffer is gone and the rest is untouched
+    speaker = run.speaker()
+    assert speaker.textBuffer == " hello world"
+    expected = np.concatenate(run.audio)[4800:]
+    np.testing.assert_array_equal(speaker.data.view(), expected)
+
+
+def test_cutoff_never_drops_audio_that_arrived_after_the_decode(harness):
+    run = harness([
+        segment((" hello", 0.0, 1.0), (" world", 1.0, 5.0)),
+        segment((" hello", 0.0, 1.0), (" world", 1.0, 5.0), (" again", 5.0, 6.0)),
+    ])
+
+    run.write(25)
+    run.step(0.2)
+    run.write(5)
+    run.step(0.2)
+
+    # The words end past the 0.6 s that was decoded, so everything decoded is dropped and nothing else
+    assert run.speaker().textBuffer == " hello world"
+    assert len(run.speaker().data) == 0
+
+    run.write(3)
+    np.testing.assert_array_equal(run.speaker().data.view(), np.concatenate(run.audio[-3:]))
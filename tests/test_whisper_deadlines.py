@@ -0,0 +1,16 @@
+def test_deadlines_are_met_exactly_on_time(harness):
+    run = harness(["hello there friend"])
+
+    run.write(25)
+    speaker = run.speaker()
+    assert speaker.phrase == " hello there friend"
+    assert not speaker.preflag
+
+    # The clock lands exactly on the prefinish deadline, the voice thread has to act on it instead of spinning
+    run.step(0.25)
+    assert speaker.preflag
+
+    deadline = run.sink.finalize_deadline(speaker)
+    run.step(deadline - run.clock.time())
+    assert run.clock.time() == deadline
+    assert not run.sink.speakers
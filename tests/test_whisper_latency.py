@@ -0,0 +1,18 @@
+def test_stale_prefinish_is_not_reported(harness):
+    run = harness(["hello there friend"])
+
+    run.write(25)
+    run.step(0.25)
+    speaker = run.speaker()
+    assert speaker.timestamps["prefinish"] == 1000.25
+
+    # Same text again, no new prefinish event is sent for it
+    run.write(5)
+    assert speaker.timestamps["decode_end"] == 1000.25
+    run.step(0.25)
+    assert speaker.preflag
+
+    run.step(run.sink.finalize_deadline(speaker) - run.clock.time())
+    assert not run.sink.speakers
+    assert "prefinish" not in speaker.timestamps
+    assert speaker.timestamps["finish"] >= speaker.timestamps["decode_end"]
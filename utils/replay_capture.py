@@ -0,0 +1,174 @@
+"""Replays a voice session recorded with sinks.capture_sink.CaptureSink into a sink, without discord.
+
+Packets are written to the sink with the same gaps between them as when they were recorded, divided by --speed.
+Every event the sink sends out is printed with the time since the replay started, followed by the sink's latency table.
+
+    python -m utils.replay_capture session.dcap --sink whisper --set quiet_phrase_timeout=1.0 --set mid_sentence_multiplier=1.5
+    python -m utils.replay_capture session.dcap --sink deepgram --speed 2
+
+--set is passed to the sink (to SinkSettings for deepgram), so timeouts can be tuned against the same audio every run.
+The sinks still time their timeouts in real time, so a --speed above 1 also shortens the silences they see.
+
+--virtual runs a whisper sink on a VirtualClock instead, stepping it 20 ms at a time as fast as the sink keeps up.
+The timeouts then behave exactly like they would live, only decoding takes no time at all on that clock.
+
+    python -m utils.replay_capture session.dcap --virtual --set quiet_phrase_timeout=0.8
+"""
+
+# Default libraries
+import argparse
+import ast
+import asyncio
+import os
+import time
+
+from sinks.capture_sink import CaptureReader
+from sinks.clock import SystemClock, VirtualClock
+
+# How far a VirtualClock is moved at a time, the length of a discord packet
+virtual_tick = 0.02
+
+
+# Stands in for discord's voice client, the sinks only look at the decoder's format
+class ReplayDecoder:
+    def __init__(self, sampling_rate, channels):
+        self.SAMPLING_RATE = sampling_rate
+        self.CHANNELS = channels
+
+
+class ReplayVoiceClient:
+    def __init__(self, sampling_rate, channels):
+        self.decoder = ReplayDecoder(sampling_rate, channels)
+
+    def stop_recording(self):
+        pass
+
+
+def make_sink(name, queue, loop, clock, settings):
+    if name == "whisper":
+        from sinks.whisper_sink import WhisperSink
+
+        return WhisperSink(queue, loop, clock=clock, **settings)
+    if name == "iwhisper":
+        from sinks.iwhisper_sink import iWhisperSink
+
+        return iWhisperSink(queue, loop, clock=clock, **settings)
+    if name == "deepgram":
+        from sinks.deepgram_sink import DeepgramSink
+
+        sink_settings = DeepgramSink.SinkSettings(os.getenv("DEEPGRAM_API_KEY"), **settings)
+        return DeepgramSink(sink_settings=sink_settings, queue=queue, loop=loop, clock=clock)
+    raise ValueError(f"Unknown sink: {name}")
+
+
+# Writes every packet of the capture to the sink on its own thread, like discord's decoder thread does
+def feed(reader, sink, speed):
+    start = time.time()
+    first = None
+    for user, timestamp, pcm in reader:
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            wait = start + (timestamp - first) / speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        sink.write(bytes(pcm), user)
+        del pcm
+
+
+# Moves a VirtualClock to when one tick at a time, letting the sink catch up after every tick
+def step_to(clock, when):
+    while clock.time() + virtual_tick < when:
+        clock.advance(virtual_tick)
+        clock.wait_idle()
+    clock.advance_to(when)
+    clock.wait_idle()
+
+
+# Same as feed() but on a VirtualClock, the sink handles every packet before the next one is written
+def feed_virtual(reader, sink, clock, tail):
+    for user, timestamp, pcm in reader:
+        step_to(clock, timestamp)
+        sink.write(bytes(pcm), user)
+        del pcm
+        clock.advance(0)
+        clock.wait_idle()
+    step_to(clock, clock.time() + tail)
+
+
+async def replay(path, sink_name, *, speed=1.0, tail=5.0, virtual=False, settings=None):
+    """Feeds the capture at path into a new sink and prints what it sends out.\n
+
+    speed - 1 for real time, 2 for twice as fast, 0 for as fast as the sink takes it\n
+    tail - Seconds to keep listening after the last packet, so the last phrase can finish\n
+    virtual - Run the sink on a VirtualClock, speed is ignored\n
+    settings - Keyword arguments for the sink\n
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    with CaptureReader(path) as reader:
+        if virtual:
+            # Starts at the first packet, so the sink sees the same times as when it was recorded
+            first = next(iter(reader), (None, time.time(), None))[1]
+            clock = VirtualClock(first)
+        else:
+            clock = SystemClock()
+
+        sink = make_sink(sink_name, queue, loop, clock, settings or {})
+        sink.init(ReplayVoiceClient(reader.sampling_rate, reader.channels))
+
+        start = clock.time()
+        if virtual:
+            feeding = loop.run_in_executor(None, feed_virtual, reader, sink, clock, tail)
+        else:
+            feeding = loop.run_in_executor(None, feed, reader, sink, speed)
+
+        async def print_events():
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                print(f"{clock.time() - start:8.3f} {event.type:<9} {event.user} #{event.utterance}.{event.sequence}: {event.result}")
+
+        printing = loop.create_task(print_events())
+        await feeding
+        if not virtual:
+            await asyncio.sleep(tail)
+
+    sink.close()
+    await printing
+
+    print()
+    print(sink.latency.report())
+
+
+def parse_setting(setting):
+    name, value = setting.split("=", 1)
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a CaptureSink recording into a sink")
+    parser.add_argument("capture", help="File written by CaptureSink")
+    parser.add_argument("--sink", choices=["whisper", "iwhisper", "deepgram"], default="whisper")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 is real time, 0 is as fast as possible")
+    parser.add_argument("--tail", type=float, default=5.0, help="Seconds to wait for the sink after the last packet")
+    parser.add_argument("--virtual", action="store_true", help="Simulate the sink's timing on a virtual clock, whisper sinks only")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Sink setting, can be repeated")
+    args = parser.parse_args()
+
+    if args.virtual and args.sink == "deepgram":
+        parser.error("--virtual can't be used with deepgram, it transcribes in real time")
+
+    settings = dict(parse_setting(setting) for setting in args.set)
+    asyncio.run(
+        replay(args.capture, args.sink, speed=args.speed, tail=args.tail, virtual=args.virtual, settings=settings)
+    )
+
+
+if __name__ == "__main__":
+    main()